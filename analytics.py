@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+笔记数据分析模块
+把全部笔记和互动数据快照载入按列存储的 NumPy 数组，向量化计算汇总、按周统计、排行和分位数；
+需要安装 NumPy
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from metrics_store import METRICS, values_from_interact_info
+
+DEFAULT_WEEKS = 12  # 默认按周统计的周数
+DEFAULT_TOP_N = 10  # 默认排行的笔记数
+PERCENTILES = (50, 75, 90, 99)  # 计算的分位数
+WEEK_SECONDS = 7 * 86400
+
+
+def available() -> bool:
+    """是否安装了 NumPy"""
+    try:
+        import numpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def note_timestamp(note: Dict) -> Optional[float]:
+    """
+    笔记的发布时间（秒）
+
+    优先使用详情中的 time（毫秒），列表接口没有该字段时从笔记ID解析：笔记ID的前8位是十六进制的发布时间戳
+    """
+    if note.get("time"):
+        try:
+            return float(note["time"]) / 1000
+        except (TypeError, ValueError):
+            pass
+    try:
+        return float(int(str(note.get("note_id", ""))[:8], 16))
+    except ValueError:
+        return None
+
+
+def compute(notes: Iterable[Dict], snapshots: Dict[str, list], weeks: int = DEFAULT_WEEKS,
+            top_n: int = DEFAULT_TOP_N, now: Optional[float] = None) -> Dict:
+    """
+    计算全部笔记的统计数据
+
+    参数:
+        notes: 笔记列表接口返回的笔记
+        snapshots: metrics_store.MetricsStore.columns() 返回的快照列
+        weeks: 按周统计最近的周数
+        top_n: 排行的笔记数
+        now: 当前时间，默认为 time.time()
+
+    返回:
+        {"totals", "percentiles", "top", "weekly"}，互动率为每天的平均互动数（点赞+评论+收藏+分享）
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    now = now if now is not None else time.time()
+    notes = [note for note in notes if note.get("note_id")]
+
+    # 笔记列：ID、标题、发布时间、列表中的点赞数
+    note_ids = np.array([note["note_id"] for note in notes], dtype=str)
+    titles = [note.get("display_title") or note.get("title") or "无标题" for note in notes]
+    published = np.array([note_timestamp(note) for note in notes], dtype=float)
+    list_likes = np.array([values_from_interact_info(note.get("interact_info")).get("likes") for note in notes],
+                          dtype=float)
+
+    # 快照列：按（笔记ID, 时间）排序，缺失的值为 NaN
+    snap_ids = np.array(snapshots["note_id"], dtype=str)
+    snap_ts = np.array(snapshots["ts"], dtype=np.int64)
+    snap_values = np.array([snapshots[metric] for metric in METRICS], dtype=float).T.reshape(len(snap_ids),
+                                                                                           len(METRICS))
+
+    # 每篇笔记最新的快照：每组的最后一行
+    values = np.full((len(note_ids), len(METRICS)), np.nan)
+    if len(snap_ids):
+        is_last = np.r_[snap_ids[1:] != snap_ids[:-1], True]
+        latest_ids, latest_values = snap_ids[is_last], snap_values[is_last]
+        position = np.searchsorted(latest_ids, note_ids).clip(max=len(latest_ids) - 1)
+        found = latest_ids[position] == note_ids
+        values[found] = latest_values[position[found]]
+    likes_index = METRICS.index("likes")
+    values[:, likes_index] = np.where(np.isnan(values[:, likes_index]), list_likes, values[:, likes_index])
+
+    interactions = np.nansum(values, axis=1)
+    age_days = np.maximum((now - np.nan_to_num(published, nan=now)) / 86400, 1)
+    rates = interactions / age_days
+
+    totals = {"notes": int(len(note_ids)), "interactions": int(interactions.sum())}
+    totals.update((metric, int(np.nansum(values[:, index]))) for index, metric in enumerate(METRICS))
+
+    columns = {metric: values[:, index] for index, metric in enumerate(METRICS)}
+    columns.update(interactions=interactions, rate=rates)
+    percentiles = {}
+    for name, column in columns.items():
+        valid = column[~np.isnan(column)]
+        points = np.percentile(valid, PERCENTILES) if len(valid) else [None] * len(PERCENTILES)
+        percentiles[name] = {f"p{p}": (round(float(v), 2) if v is not None else None)
+                             for p, v in zip(PERCENTILES, points)}
+
+    def ranking(column) -> List[Dict]:
+        order = np.argsort(-np.nan_to_num(column, nan=-1), kind="stable")[:top_n]
+        result = []
+        for index in order:
+            item = {"note_id": str(note_ids[index]), "title": titles[index]}
+            item.update((metric, None if np.isnan(values[index, i]) else int(values[index, i]))
+                        for i, metric in enumerate(METRICS))
+            item["interactions"] = int(interactions[index])
+            item["rate"] = round(float(rates[index]), 2)
+            result.append(item)
+        return result
+
+    top = {"likes": ranking(columns["likes"]), "interactions": ranking(interactions), "rate": ranking(rates)}
+
+    # 按周统计：以本周一零点为最后一周的开始
+    today = datetime.fromtimestamp(now).date()
+    this_week = datetime.combine(today - timedelta(days=today.weekday()), datetime.min.time()).timestamp()
+    first_week = this_week - (weeks - 1) * WEEK_SECONDS
+
+    def week_index(timestamps):
+        index = np.floor((timestamps - first_week) / WEEK_SECONDS)
+        valid = (index >= 0) & (index < weeks)
+        return index[valid].astype(np.int64), valid
+
+    index, valid = week_index(published[~np.isnan(published)])
+    published_per_week = np.bincount(index, minlength=weeks)
+
+    # 每周新增的互动：同一笔记相邻两条快照的差值计入后一条所在的周
+    gains = np.zeros((weeks, len(METRICS)))
+    if len(snap_ids) > 1:
+        same_note = snap_ids[1:] == snap_ids[:-1]
+        deltas = np.nan_to_num(snap_values[1:] - snap_values[:-1])[same_note]
+        index, valid = week_index(snap_ts[1:][same_note].astype(float))
+        for i in range(len(METRICS)):
+            gains[:, i] = np.bincount(index, weights=deltas[valid, i], minlength=weeks)
+
+    weekly = []
+    for week in range(weeks):
+        item = {"week": datetime.fromtimestamp(first_week + week * WEEK_SECONDS).strftime("%Y-%m-%d"),
+                "published": int(published_per_week[week])}
+        item.update((metric, int(gains[week, i])) for i, metric in enumerate(METRICS))
+        weekly.append(item)
+
+    return {
+        "totals": totals,
+        "percentiles": percentiles,
+        "top": top,
+        "weekly": weekly,
+        "snapshots": int(len(snap_ids)),
+        "generated_at": datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
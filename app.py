@@ -10,13 +10,22 @@ import os
 import json
 import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, make_response, stream_with_context, send_file
 import random
-import requests
 import threading
-import functools
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wsgi import ClosingIterator
 
+import analytics
+import http_session
+import thumbnails
+from cache_manager import CacheManager
+from image_cache import ImageCache
+from metrics_store import MetricsStore, parse_count, values_from_interact_info
+from note_sync import NoteSync
+from persistent_store import PersistentStore, PersistentDict
+from scheduler import Scheduler
+from token_registry import TokenRegistry
 from xhs_api import XhsSimpleApi
 # 创建Flask应用
 app = Flask(__name__)
@@ -29,124 +38,319 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # 全局API客户端
 api_client = None
+# xsec_token 记录和笔记列表的本地副本，第一次创建API客户端时创建，重新登录后继续使用
+xsec_tokens = None
+note_sync = None
+# 连接池、缓存配置和后台线程只在进程内启动一次
+services_started = False
+init_lock = threading.Lock()
 
 # 配置文件路径
 CONFIG_FILE = 'config.json'
 
+# 缓存配置，stale_ttl 为过期后仍直接返回旧数据（同时后台刷新）的时长，
+# 超过 ttl + stale_ttl 后请求会阻塞等待重新获取；persist 的命名空间同时写入本地SQLite，重启后直接可用；
+# 可在 config.json 的 "cache" 中按命名空间覆盖
+CACHE_SETTINGS = {
+    'notes': {'ttl': 300, 'stale_ttl': 3600, 'max_entries': 4, 'persist': True},  # 5分钟缓存，第一页笔记及下一页游标
+    'followers': {'ttl': 600, 'stale_ttl': 3600, 'max_entries': 16, 'persist': True},  # 10分钟缓存
+    'note_details': {'ttl': 1800, 'stale_ttl': 86400, 'max_entries': 500, 'persist': True},  # 笔记详情缓存，按笔记ID存储
+    'comments': {'ttl': 300, 'stale_ttl': 3600, 'max_entries': 500, 'persist': True},  # 评论分页缓存，按笔记ID和游标存储
+    'analytics': {'ttl': 300, 'stale_ttl': 3600, 'max_entries': 8},  # 统计结果，按周数和排行数存储，只依赖本地数据
+}
+
+# 持久化存储，保存缓存数据和xsec_token
+store = PersistentStore()
+
 # 缓存数据
-cache = {
-    'notes': {'data': None, 'timestamp': 0, 'ttl': 300},  # 5分钟缓存
-    'followers': {'data': None, 'timestamp': 0, 'ttl': 600},  # 10分钟缓存
-    'note_details': {},  # 笔记详情缓存，按笔记ID存储
+cache = CacheManager(store)
+for _name, _settings in CACHE_SETTINGS.items():
+    cache.register(_name, **_settings)
+
+# 图片缓存（内存 + 磁盘）
+images = ImageCache()
+
+# 笔记互动数据的时序存储
+metrics = MetricsStore()
+METRICS_DEFAULT_DAYS = 30  # 互动数据接口默认返回的天数
+IMAGE_CHUNK_SIZE = 64 * 1024  # 转发上游图片时每次读取的字节数
+IMAGE_BROWSER_MAX_AGE = 86400  # 浏览器缓存图片的时间（秒）
+IMAGE_WAIT_TIMEOUT = 30  # 等待其他请求下载同一张图片的最长时间（秒）
+IMAGE_REQUEST_HEADERS = {  # 请求图片CDN时模拟浏览器的请求头
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
+    "Referer": "https://www.xiaohongshu.com/",
+    "Origin": "https://www.xiaohongshu.com",
+    "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+}
+
+# 并发请求上游接口的线程池
+upstream_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream')
+
+# 笔记详情预取配置
+PREFETCH_MAX_NOTES = 20  # 每轮最多预取的笔记数
+PREFETCH_CONCURRENCY = 3  # 同时预取的笔记数
+PREFETCH_MIN_INTERVAL = 0.5  # 相邻两次预取的最小间隔（秒）
+PREFETCH_BUDGET = 60  # 每轮预取的时间预算（秒），超出后不再开始新的预取
+
+# 图片预热配置，宽度与模板中请求的缩略图一致
+COVER_THUMBNAIL_WIDTHS = (300, 600)  # 首页封面（1x / 2x）
+DETAIL_THUMBNAIL_WIDTH = 1080  # 详情页图片
+PREWARM_MAX_IMAGES = 100  # 每轮最多预热的图片数
+PREWARM_CONCURRENCY = 3  # 同时预热的图片数
+PREWARM_BUDGET = 120  # 每轮预热的时间预算（秒）
+
+# 后台刷新任务：名称 -> (间隔秒数, 优先级, 首次执行前的等待秒数)，优先级数值越小越先执行
+REFRESH_JOBS = {
+    'notes': (240, 0, 0),  # 笔记列表增量同步，完成后触发详情预取
+    'notes_full': (3600, 4, 300),  # 笔记列表全量同步，清理已删除的笔记，实际间隔见 note_sync.FULL_SYNC_INTERVAL
+    'note_details': (900, 1, 30),  # 笔记详情预取和图片预热
+    'followers': (540, 2, 5),  # 关注者列表
+    'tokens': (3600, 3, 120),  # 补全笔记列表中缺失的xsec_token
+    'metrics': (3600, 3, 60),  # 记录全部笔记的互动数据快照
+    'maintenance': (600, 5, 600),  # 清理过期缓存
 }
+scheduler = Scheduler('refresh-scheduler')
+
+def is_cacheable(data):
+    """上游返回错误时不写入缓存，避免覆盖仍可使用的旧数据"""
+    if 'stats' in data:
+        return not data['stats'].get('error')
+    return not data.get('error')
+
+def get_cached_note_detail(note_id):
+    """获取缓存的笔记详情数据，已过期但在陈旧窗口内时返回旧数据并在后台刷新"""
+    entry = cache.get_stale('note_details', note_id)
+    if entry is None:
+        return None
+    if entry.is_fresh():
+        print(f"使用缓存的笔记详情: {note_id}")
+    else:
+        print(f"使用过期的笔记详情并在后台刷新: {note_id}")
+        cache.revalidate('note_details', lambda: load_note_detail(note_id), key=note_id, should_cache=is_cacheable)
+    return entry.value
 
-# 后台任务锁
-background_tasks_lock = threading.Lock()
-background_tasks_running = False
+def is_note_detail_fresh(note_id):
+    """笔记详情缓存是否存在且未过期"""
+    return cache.is_fresh('note_details', note_id)
 
-def cache_data(cache_key, ttl=300):
+def cache_needs_refresh(name):
+    """缓存不存在或已超过有效期的一半"""
+    entry = cache.get_entry(name)
+    return entry is None or entry.age > entry.ttl / 2
+
+def prefetch_note_details(notes_data):
     """
-    缓存装饰器，用于缓存函数返回值
+    预取笔记详情和第一页评论，填充笔记详情缓存
     
-    参数:
-        cache_key: 缓存键名
-        ttl: 缓存有效期（秒）
+    有界并发执行，相邻两次预取之间至少间隔PREFETCH_MIN_INTERVAL秒，
+    每轮最多预取PREFETCH_MAX_NOTES条，超过PREFETCH_BUDGET秒后停止
     """
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            # 检查是否有缓存
-            if cache_key in cache and cache[cache_key]['data'] is not None:
-                # 检查缓存是否过期
-                if time.time() - cache[cache_key]['timestamp'] < cache[cache_key]['ttl']:
-                    print(f"使用缓存数据: {cache_key}")
-                    return cache[cache_key]['data']
-            
-            # 没有缓存或缓存已过期，调用原函数
-            result = func(*args, **kwargs)
-            
-            # 更新缓存
-            if cache_key in cache:
-                cache[cache_key]['data'] = result
-                cache[cache_key]['timestamp'] = time.time()
-                cache[cache_key]['ttl'] = ttl
-            else:
-                cache[cache_key] = {'data': result, 'timestamp': time.time(), 'ttl': ttl}
-            
-            return result
-        return wrapper
-    return decorator
-
-def cache_note_detail(note_id, data, ttl=1800):
-    """缓存笔记详情数据"""
-    cache['note_details'][note_id] = {
-        'data': data,
-        'timestamp': time.time(),
-        'ttl': ttl
-    }
+    note_ids = [note.get('note_id') for note in notes_data if note.get('note_id')]
+    note_ids = [note_id for note_id in note_ids if not is_note_detail_fresh(note_id)][:PREFETCH_MAX_NOTES]
+    if not note_ids:
+        return 0
+    
+    print(f"开始预取笔记详情: {len(note_ids)}条")
+    start = time.time()
+    rate_lock = threading.Lock()
+    last_start = [0.0]
+    
+    def prefetch(note_id):
+        # 控制请求速率，并检查时间预算
+        with rate_lock:
+            wait = last_start[0] + PREFETCH_MIN_INTERVAL - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            if time.time() - start > PREFETCH_BUDGET:
+                return False
+            last_start[0] = time.time()
+        if is_note_detail_fresh(note_id):
+            return False
+        try:
+            # 与同一笔记正在进行的详情页请求合并，只请求一次
+            render_data = cache.get_or_compute('note_details', lambda: load_note_detail(note_id), key=note_id,
+                                               should_cache=is_cacheable)
+            return not render_data['stats'].get('error')
+        except Exception as e:
+            print(f"预取笔记详情失败 {note_id}: {e}")
+        return False
+    
+    with ThreadPoolExecutor(max_workers=PREFETCH_CONCURRENCY, thread_name_prefix='prefetch') as executor:
+        prefetched = sum(1 for ok in executor.map(prefetch, note_ids) if ok)
+    
+    print(f"预取笔记详情完成: {prefetched}/{len(note_ids)}条，耗时{time.time() - start:.1f}秒")
+    return prefetched
 
-def get_cached_note_detail(note_id):
-    """获取缓存的笔记详情数据"""
-    if note_id in cache['note_details']:
-        note_cache = cache['note_details'][note_id]
-        if time.time() - note_cache['timestamp'] < note_cache['ttl']:
-            print(f"使用缓存的笔记详情: {note_id}")
-            return note_cache['data']
-    return None
-
-def start_background_refresh():
-    """启动后台刷新任务"""
-    global background_tasks_running
-    
-    with background_tasks_lock:
-        if background_tasks_running:
-            return
-        background_tasks_running = True
-    
-    def refresh_task():
-        global background_tasks_running
+def collect_prewarm_images(notes_data):
+    """
+    收集需要预热的图片：笔记列表中的封面，以及已缓存详情的笔记的图片
+    
+    返回:
+        [(图片URL, 缩略图宽度)]，未安装 Pillow 时只预热原图，宽度为None
+    """
+    jobs = []
+    for note in format_notes_data(notes_data):
+        if note['cover']:
+            jobs.extend((note['cover'], width) for width in COVER_THUMBNAIL_WIDTHS)
+        entry = cache.get_entry('note_details', note['note_id'])
+        if entry is not None:
+            jobs.extend((url, DETAIL_THUMBNAIL_WIDTH) for url in entry.value.get('images', []) if url)
+    
+    if not thumbnails.available():
+        jobs = [(url, None) for url in dict.fromkeys(url for url, _ in jobs)]
+    return jobs
+
+def is_image_warm(image_url, width):
+    if width is None:
+        return images.contains(image_url)
+    return images.contains(image_url, thumbnails.variant_name(width, 'webp'))
+
+def prewarm_images(notes_data):
+    """
+    把封面和详情页图片（及其缩略图）下载到图片缓存，跳过已缓存的图片
+    
+    有界并发执行，每轮最多预热PREWARM_MAX_IMAGES张，超过PREWARM_BUDGET秒后停止
+    """
+    jobs = [job for job in collect_prewarm_images(notes_data) if not is_image_warm(*job)][:PREWARM_MAX_IMAGES]
+    if not jobs:
+        return 0
+    
+    print(f"开始预热图片: {len(jobs)}张")
+    start = time.time()
+    
+    def prewarm(job):
+        image_url, width = job
+        if time.time() - start > PREWARM_BUDGET:
+            return False
         try:
-            print("后台刷新任务开始运行")
-            
-            # 检查是否已登录
-            if not api_client:
-                if not init_api_client():
-                    print("后台刷新任务: API客户端未初始化")
-                    with background_tasks_lock:
-                        background_tasks_running = False
-                    return
-            
-            # 获取用户信息
-            try:
-                self_info = api_client.client.get_self_info2()
-                user_id = self_info.get('user_id', '')
-                
-                if user_id:
-                    # 预加载笔记列表
-                    if 'notes' in cache and (time.time() - cache['notes']['timestamp'] > cache['notes']['ttl'] / 2):
-                        print("后台刷新笔记列表")
-                        notes_data = api_client.get_user_notes(user_id)
-                        cache['notes']['data'] = notes_data
-                        cache['notes']['timestamp'] = time.time()
-                    
-                    # 预加载关注者列表
-                    if 'followers' in cache and (time.time() - cache['followers']['timestamp'] > cache['followers']['ttl'] / 2):
-                        print("后台刷新关注者列表")
-                        followers_data = api_client.get_followers()
-                        cache['followers']['data'] = followers_data
-                        cache['followers']['timestamp'] = time.time()
-            except Exception as e:
-                print(f"后台刷新任务异常: {e}")
-        finally:
-            with background_tasks_lock:
-                background_tasks_running = False
-            print("后台刷新任务结束")
+            if width is None:
+                fetch_image(image_url)
+            else:
+                get_thumbnail(image_url, width, 'webp')
+            return True
+        except Exception as e:
+            print(f"预热图片失败 {image_url}: {e}")
+            return False
+    
+    with ThreadPoolExecutor(max_workers=PREWARM_CONCURRENCY, thread_name_prefix='prewarm') as executor:
+        warmed = sum(1 for ok in executor.map(prewarm, jobs) if ok)
+    
+    print(f"预热图片完成: {warmed}/{len(jobs)}张，耗时{time.time() - start:.1f}秒")
+    return warmed
+
+def ensure_api_client():
+    """后台任务使用，API客户端未初始化时抛出异常，由调度器退避重试"""
+    if not api_client and not init_api_client():
+        raise RuntimeError("API客户端未初始化")
+
+def cached_notes():
+    """缓存中（可能已过期）的第一页笔记"""
+    entry = cache.get_entry('notes')
+    return entry.value['notes'] if entry is not None else []
+
+def refresh_notes_job():
+    """增量同步笔记列表，完成后让详情预取任务尽快执行"""
+    ensure_api_client()
+    if not cache_needs_refresh('notes'):
+        return "未到刷新时间"
+    user_id = get_current_user_id()
+    if not user_id:
+        raise RuntimeError("获取用户ID失败")
+    print("后台同步笔记列表")
+    # 与 /api/notes 正在进行的加载合并为一次请求
+    notes_page = cache.refresh('notes', lambda: note_sync.sync(user_id), should_cache=is_cacheable)
+    if notes_page.get('error'):
+        raise RuntimeError(f"获取笔记列表失败: {notes_page['error']}")
+    scheduler.trigger('note_details')
+    if not note_sync.complete:
+        scheduler.trigger('notes_full')
+    return len(notes_page['notes'])
+
+def refresh_notes_full_job():
+    """全量同步笔记列表，删除上游已不存在的笔记"""
+    ensure_api_client()
+    if not note_sync.full_sync_due():
+        return "未到全量同步时间"
+    user_id = get_current_user_id()
+    if not user_id:
+        raise RuntimeError("获取用户ID失败")
+    print("后台全量同步笔记列表")
+    notes_page = cache.refresh('notes', lambda: note_sync.sync(user_id, full=True), should_cache=is_cacheable)
+    if notes_page.get('error'):
+        raise RuntimeError(f"全量同步笔记列表失败: {notes_page['error']}")
+    return note_sync.stats()['notes']
+
+def refresh_note_details_job():
+    """预取笔记详情，让首次打开详情页时直接命中缓存，并预热封面和详情页图片"""
+    ensure_api_client()
+    notes_data = cached_notes()
+    prefetched = prefetch_note_details(notes_data)
+    warmed = prewarm_images(notes_data)
+    return f"预取详情{prefetched}条，预热图片{warmed}张"
+
+def refresh_followers_job():
+    """刷新关注者列表"""
+    ensure_api_client()
+    if not cache_needs_refresh('followers'):
+        return "未到刷新时间"
+    print("后台刷新关注者列表")
+    followers_data = cache.refresh('followers', api_client.get_followers, should_cache=is_cacheable)
+    if followers_data.get('error'):
+        raise RuntimeError(f"获取关注者列表失败: {followers_data['error']}")
+    return len(followers_data.get('followers', []))
+
+def refresh_tokens_job():
+    """通过一次列表翻页补全缓存笔记中缺失的xsec_token"""
+    ensure_api_client()
+    note_ids = [note.get('note_id') for note in cached_notes() if note.get('note_id')]
+    return api_client.refresh_xsec_tokens(note_ids)
+
+def snapshot_metrics_job():
+    """
+    用同步到本地的笔记列表记录点赞数，评论、收藏等沿用获取详情时记录的值
+    
+    只记录上一条快照之后重新获取过的笔记，快照时间为获取笔记列表的时间，避免旧数据写在新数据之后；
+    只读取本地数据，不需要API客户端
+    """
+    if note_sync is None:
+        return "笔记列表尚未同步"
+    snapshots = []
+    for note_id, note in note_sync.notes.items():
+        fetched_at = note_sync.fetched_at.get(note_id)
+        latest = metrics.latest(note_id)
+        if fetched_at is None or (latest is not None and int(fetched_at) <= latest['timestamp']):
+            continue
+        snapshots.append((note_id, values_from_interact_info(note.get('interact_info')), fetched_at))
+    return metrics.record_many(snapshots)
+
+def maintenance_job():
+    """清理已过期的缓存条目"""
+    return cache.purge_expired()
+
+def start_background_refresh(*job_names):
+    """
+    启动后台调度（只启动一次）
+    
+    参数:
+        job_names: 需要尽快执行的任务，对应的缓存需要刷新时立即触发
+    """
+    jobs = {
+        'notes': refresh_notes_job,
+        'notes_full': refresh_notes_full_job,
+        'note_details': refresh_note_details_job,
+        'followers': refresh_followers_job,
+        'tokens': refresh_tokens_job,
+        'metrics': snapshot_metrics_job,
+        'maintenance': maintenance_job,
+    }
+    for name, func in jobs.items():
+        interval, priority, delay = REFRESH_JOBS[name]
+        scheduler.add_job(name, func, interval, priority=priority, delay=delay)
+    scheduler.start()
     
-    # 启动后台线程
-    thread = threading.Thread(target=refresh_task)
-    thread.daemon = True
-    thread.start()
-    print("后台刷新任务已启动")
+    for name in job_names:
+        if cache_needs_refresh(name):
+            scheduler.trigger(name)
 
 
 # 添加全局模板变量
@@ -169,16 +373,42 @@ def save_config(config):
         json.dump(config, f, ensure_ascii=False, indent=4)
 
 
+def configure_cache(overrides):
+    """用配置文件中的设置覆盖各缓存命名空间的默认配置"""
+    for name, settings in CACHE_SETTINGS.items():
+        cache.register(name, **{**settings, **overrides.get(name, {})})
+
+
 def init_api_client():
-    """初始化API客户端"""
-    global api_client
+    """初始化API客户端，重复调用（如重新登录）时只替换客户端，沿用已有的数据和后台任务"""
+    global api_client, note_sync, xsec_tokens, services_started
     config = load_config()
     cookie = config.get("cookie", "")
     if cookie:
         try:
-            api_client = XhsSimpleApi(cookie)
-            # 启动后台刷新任务
-            start_background_refresh()
+            with init_lock:
+                if not services_started:
+                    http_session.configure(**config.get("http", {}))
+                    configure_cache(config.get("cache", {}))
+                    images.start_sweeper()
+                if xsec_tokens is None:
+                    xsec_tokens = TokenRegistry(
+                        PersistentDict(store, 'xsec_tokens'),
+                        PersistentDict(store, 'xsec_user_tokens'),
+                        PersistentDict(store, 'xsec_unavailable')
+                    )
+                client = XhsSimpleApi(cookie, signer=config.get("signer"), xsec_tokens=xsec_tokens)
+                client.user_id = config.get("user_id") or None
+                if note_sync is None:
+                    note_sync = NoteSync(client, PersistentDict(store, 'synced_notes'), PersistentDict(store, 'note_sync'),
+                                         PersistentDict(store, 'note_fetched_at'))
+                else:
+                    note_sync.api = client
+                api_client = client
+                if not services_started:
+                    # 启动后台刷新任务
+                    start_background_refresh()
+                    services_started = True
             return True
         except Exception as e:
             print(f"初始化API客户端失败: {e}")
@@ -212,24 +442,25 @@ def index():
             flash(f'获取用户信息失败: {e}', 'danger')
             return redirect(url_for('login'))
     
-    # 检查是否有缓存的笔记列表
-    has_cache = 'notes' in cache and cache['notes']['data'] is not None and time.time() - cache['notes']['timestamp'] < cache['notes']['ttl']
+    # 检查是否有缓存的笔记列表（包括陈旧窗口内的过期数据）
+    entry = cache.get_stale('notes')
     
     # 如果有缓存，直接使用缓存数据
-    if has_cache:
-        print("使用缓存的笔记列表")
-        notes_data = cache['notes']['data']
-        formatted_notes = format_notes_data(notes_data)
+    if entry is not None:
+        notes_page = entry.value
+        print("使用缓存的笔记列表" if entry.is_fresh() else "使用过期的笔记列表并在后台刷新")
+        formatted_notes = format_notes_data(notes_page['notes'])
         
-        # 在后台刷新数据（如果缓存接近过期）
-        if time.time() - cache['notes']['timestamp'] > cache['notes']['ttl'] / 2:
-            start_background_refresh()
+        # 在后台刷新数据（如果缓存接近过期或已过期）
+        start_background_refresh('notes')
         
-        return render_template('index.html', notes=formatted_notes, loading=False)
+        return render_template('index.html', notes=formatted_notes, loading=False,
+                               next_cursor=notes_page.get('cursor', ''),
+                               has_more=notes_page.get('has_more', False))
     else:
         # 如果没有缓存，先返回加载中页面，然后通过AJAX加载数据
         # 启动后台任务加载数据
-        start_background_refresh()
+        start_background_refresh('notes')
         return render_template('index.html', notes=[], loading=True)
 
 
@@ -259,23 +490,104 @@ def api_notes():
     
     try:
         # 获取用户笔记列表（使用缓存）
-        if 'notes' in cache and cache['notes']['data'] is not None and time.time() - cache['notes']['timestamp'] < cache['notes']['ttl']:
-            print("API使用缓存的笔记列表")
-            notes_data = cache['notes']['data']
-        else:
-            print("API获取新的笔记列表")
-            notes_data = api_client.get_user_notes(user_id)
-            cache['notes']['data'] = notes_data
-            cache['notes']['timestamp'] = time.time()
+        def load_notes():
+            print("API同步笔记列表")
+            return note_sync.sync(user_id)
+        
+        notes_page = cache.get_or_revalidate('notes', load_notes, should_cache=is_cacheable)
         
         # 格式化笔记数据
-        formatted_notes = format_notes_data(notes_data)
+        formatted_notes = format_notes_data(notes_page['notes'])
+        
+        return jsonify({
+            "notes": formatted_notes,
+            "cursor": notes_page.get('cursor', ''),
+            "has_more": notes_page.get('has_more', False)
+        })
+    except Exception as e:
+        return jsonify({"error": f"获取笔记列表失败: {e}"}), 500
+
+
+@app.route('/api/notes/page')
+def api_notes_page():
+    """API端点：按游标获取一页笔记，用于首页无限滚动"""
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
+    
+    cursor = request.args.get('cursor', '')
+    count = request.args.get('count', 20, type=int)
+    try:
+        user_id = get_current_user_id()
+        if not user_id:
+            return jsonify({"error": "获取用户ID失败"}), 500
+        
+        # 完成过全量同步时直接从本地返回，否则请求上游
+        page = note_sync.page(cursor, count) or api_client.get_user_notes_page(user_id, cursor, count)
+        if page.get('error'):
+            return jsonify({"error": f"获取笔记列表失败: {page['error']}"}), 500
         
-        return jsonify({"notes": formatted_notes})
+        return jsonify({
+            "notes": format_notes_data(page['notes']),
+            "cursor": page['cursor'],
+            "has_more": page['has_more']
+        })
     except Exception as e:
         return jsonify({"error": f"获取笔记列表失败: {e}"}), 500
 
 
+@app.route('/api/notes/stream')
+def api_notes_stream():
+    """
+    API端点：以NDJSON格式流式返回全部笔记
+    
+    每获取一页就输出一行 {"notes": [...], "cursor": "...", "has_more": true}，
+    客户端可以保存最后的cursor，之后通过?cursor=从中断处继续
+    """
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
+    
+    cursor = request.args.get('cursor', '')
+    count = request.args.get('count', 20, type=int)
+    max_pages = request.args.get('max_pages', None, type=int)
+    try:
+        user_id = get_current_user_id()
+    except Exception as e:
+        return jsonify({"error": f"获取用户信息失败: {e}"}), 500
+    if not user_id:
+        return jsonify({"error": "获取用户ID失败"}), 500
+    
+    def generate():
+        for page in api_client.iter_user_note_pages(user_id, cursor, count, max_pages):
+            line = {
+                "notes": format_notes_data(page['notes']),
+                "cursor": page['cursor'],
+                "has_more": page['has_more']
+            }
+            if page.get('error'):
+                line['error'] = page['error']
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def get_current_user_id():
+    """获取当前用户ID，优先使用客户端中已知的，其次从配置中读取，都没有时从API获取并保存"""
+    if api_client.user_id:
+        return api_client.user_id
+    config = load_config()
+    user_id = config.get("user_id", "")
+    if not user_id:
+        self_info = api_client.client.get_self_info2()
+        user_id = self_info.get('user_id', '')
+        if user_id:
+            config["user_id"] = user_id
+            save_config(config)
+    api_client.user_id = user_id or None
+    return user_id
+
+
 def format_notes_data(notes_data):
     """格式化笔记数据"""
     formatted_notes = []
@@ -294,12 +606,8 @@ def format_notes_data(notes_data):
             if info_list and len(info_list) > 0:
                 cover_url = info_list[0].get('url', '')
         
-        # 处理点赞数
-        likes = interact_info.get('liked_count', '0')
-        try:
-            likes = int(likes)
-        except:
-            likes = 0
+        # 处理点赞数（可能是"1.2万"这类格式）
+        likes = parse_count(interact_info.get('liked_count')) or 0
         
         formatted_note = {
             'note_id': note.get('note_id', ''),
@@ -425,80 +733,23 @@ def publish():
     return render_template('publish.html')
 
 
-@app.route('/note/<note_id>')
-def note_detail(note_id):
-    """笔记详情页面"""
-    # 检查是否已登录
-    if not api_client:
-        if not init_api_client():
-            flash('请先登录', 'danger')
-            return redirect(url_for('login'))
-    
-    # 检查缓存
-    cached_data = get_cached_note_detail(note_id)
-    if cached_data:
-        return render_template('note_detail.html', **cached_data)
-    
-    # 使用新API获取笔记详情
-    note_data = api_client.get_note_by_id(note_id)
-    
-    # 使用小红书评论API获取评论
-    comments = []
+def fetch_note_comments(note_id, xsec_token=""):
+    """获取笔记的第一页评论"""
+    return api_client.get_note_comments(note_id, xsec_token=xsec_token)
+
+
+def timed_call(timings, name, func, *args):
+    """调用函数并把耗时（毫秒）记录到timings中"""
+    start = time.perf_counter()
     try:
-        # 获取xsec_token
-        xsec_token = ""
-        if note_data and "xsec_token" in note_data:
-            xsec_token = note_data["xsec_token"]
-        else:
-            # 如果笔记详情中没有xsec_token，尝试从api_client的缓存中获取
-            xsec_token = api_client.xsec_tokens.get(note_id, "")
-        
-        # 构建评论API请求URL
-        comment_url = f"https://edith.xiaohongshu.com/api/sns/web/v2/comment/page"
-        params = {
-            "note_id": note_id,
-            "cursor": "",
-            "top_comment_id": "",
-            "image_formats": "jpg,webp,avif"
-        }
-        
-        # 如果有xsec_token，添加到参数中
-        if xsec_token:
-            params["xsec_token"] = xsec_token
-        
-        # 使用与api_client相同的cookie发送请求
-        headers = {
-            "Cookie": api_client.cookie,
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-            "Origin": "https://www.xiaohongshu.com",
-            "Referer": f"https://www.xiaohongshu.com/explore/{note_id}"
-        }
-        
-        # 发送请求获取评论数据
-        response = requests.get(comment_url, params=params, headers=headers)
-        
-        if response.status_code == 200:
-            comment_data = response.json()
-            if "data" in comment_data and "comments" in comment_data["data"]:
-                raw_comments = comment_data["data"]["comments"]
-                
-                # 处理评论数据
-                for comment in raw_comments:
-                    comments.append({
-                        'comment_id': comment.get("id", ""),
-                        'content': comment.get("content", ""),
-                        'user_id': comment.get("user_info", {}).get("user_id", ""),
-                        'nickname': comment.get("user_info", {}).get("nickname", ""),
-                        'avatar': comment.get("user_info", {}).get("image", ""),
-                        'likes': int(comment.get("like_count", 0)),
-                        'time': comment.get("create_time", ""),
-                        'sub_comments': int(comment.get("sub_comment_count", 0))
-                    })
-        else:
-            print(f"获取评论失败，状态码: {response.status_code}")
-    except Exception as e:
-        print(f"获取评论异常: {e}")
-    
+        return func(*args)
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+def build_note_render_data(note_id, note_data, comments_page):
+    """根据笔记详情和第一页评论构建详情页的渲染数据"""
+    images = []
     if not note_data:
         stats = {'error': '获取笔记详情失败'}
     else:
@@ -514,7 +765,6 @@ def note_detail(note_id):
         }
         
         # 获取图片列表
-        images = []
         if 'image_list' in note_data:
             for image in note_data.get('image_list', []):
                 # 直接使用info_list中的URL
@@ -537,18 +787,119 @@ def note_detail(note_id):
                             images.append(info.get('url'))
                             break
     
-    # 准备渲染数据
-    render_data = {
+    return {
         'stats': stats,
-        'comments': comments,
+        'comments': comments_page.get('comments', []),
+        'comments_cursor': comments_page.get('cursor', ''),
+        'comments_has_more': comments_page.get('has_more', False),
         'note_id': note_id,
-        'images': images if 'images' in locals() else []
+        'images': images
     }
+
+
+def load_note_detail(note_id, timings=None):
+    """
+    获取笔记详情和第一页评论
+    
+    已知xsec_token时两个请求并发执行，否则先获取详情拿到xsec_token再获取评论
+    """
+    if timings is None:
+        timings = {}
+    
+    xsec_token = api_client.xsec_tokens.get(note_id, "")
+    if xsec_token:
+        detail_future = upstream_executor.submit(timed_call, timings, 'detail', api_client.get_note_by_id, note_id)
+        comments_future = upstream_executor.submit(timed_call, timings, 'comments', fetch_note_comments, note_id, xsec_token)
+        note_data = detail_future.result()
+        comments_page = comments_future.result()
+    else:
+        # 使用新API获取笔记详情
+        note_data = timed_call(timings, 'detail', api_client.get_note_by_id, note_id)
+        # 如果笔记详情中没有xsec_token，尝试从api_client的缓存中获取
+        if note_data and "xsec_token" in note_data:
+            xsec_token = note_data["xsec_token"]
+        else:
+            xsec_token = api_client.xsec_tokens.get(note_id, "")
+        comments_page = timed_call(timings, 'comments', fetch_note_comments, note_id, xsec_token)
     
-    # 缓存数据
-    cache_note_detail(note_id, render_data)
+    # 详情中有完整的互动数据，每次获取时记录一条快照
+    if note_data:
+        metrics.record(note_id, values_from_interact_info(note_data.get('interact_info')))
+    
+    return build_note_render_data(note_id, note_data, comments_page)
+
+
+@app.route('/note/<note_id>')
+def note_detail(note_id):
+    """笔记详情页面"""
+    # 检查是否已登录
+    if not api_client:
+        if not init_api_client():
+            flash('请先登录', 'danger')
+            return redirect(url_for('login'))
+    
+    # 检查缓存
+    cached_data = get_cached_note_detail(note_id)
+    if cached_data:
+        return render_template('note_detail.html', **cached_data)
+    
+    # 同一笔记的并发请求（包括后台预取）只加载一次，其余请求等待并共享结果，
+    # 此时 timings 中只有 total
+    start = time.perf_counter()
+    timings = {}
+    render_data = cache.load('note_details', lambda: load_note_detail(note_id, timings), key=note_id,
+                             should_cache=is_cacheable)
+    timings['total'] = (time.perf_counter() - start) * 1000
+    print(f"笔记详情 {note_id} 耗时: " + ", ".join(f"{name}={ms:.0f}ms" for name, ms in timings.items()))
+    
+    resp = make_response(render_template('note_detail.html', **render_data))
+    resp.headers['Server-Timing'] = ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+    return resp
+
+
+@app.route('/api/note/<note_id>/comments')
+def api_note_comments(note_id):
+    """API端点：按游标获取一页评论，用于详情页逐步加载"""
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
+    
+    cursor = request.args.get('cursor', '')
+    page = cache.get_or_revalidate('comments', lambda: api_client.get_note_comments(note_id, cursor),
+                                   key=f"{note_id}:{cursor}", should_cache=is_cacheable)
+    if page.get('error'):
+        return jsonify({"error": f"获取评论失败: {page['error']}"}), 500
+    return jsonify(page)
+
+
+@app.route('/api/note/<note_id>/comments/stream')
+def api_note_comments_stream(note_id):
+    """API端点：以NDJSON格式流式返回评论，每获取一页输出一行"""
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
+    
+    cursor = request.args.get('cursor', '')
+    max_pages = request.args.get('max_pages', None, type=int)
+    
+    def generate():
+        for page in api_client.iter_note_comments(note_id, cursor, max_pages=max_pages):
+            yield json.dumps(page, ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/note/<note_id>/comments/<comment_id>/replies')
+def api_comment_replies(note_id, comment_id):
+    """API端点：按需展开一条评论的回复"""
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
     
-    return render_template('note_detail.html', **render_data)
+    page = api_client.get_note_sub_comments(note_id, comment_id, request.args.get('cursor', ''))
+    if page.get('error'):
+        return jsonify({"error": f"获取回复失败: {page['error']}"}), 500
+    return jsonify(page)
 
 
 @app.route('/followers')
@@ -561,18 +912,15 @@ def followers():
             return redirect(url_for('login'))
     
     # 使用缓存
-    if 'followers' in cache and cache['followers']['data'] is not None and time.time() - cache['followers']['timestamp'] < cache['followers']['ttl']:
-        print("使用缓存的关注者列表")
-        followers_data = cache['followers']['data']
-    else:
+    def load_followers():
         print("获取新的关注者列表")
         # 获取关注者列表
-        followers_data = api_client.get_followers()
-        cache['followers']['data'] = followers_data
-        cache['followers']['timestamp'] = time.time()
+        return api_client.get_followers()
+    
+    followers_data = cache.get_or_revalidate('followers', load_followers, should_cache=is_cacheable)
     
     # 启动后台刷新任务
-    start_background_refresh()
+    start_background_refresh('followers')
     
     return render_template('followers.html', followers_data=followers_data)
 
@@ -580,12 +928,7 @@ def followers():
 @app.route('/clear_cache')
 def clear_cache():
     """清除缓存数据"""
-    global cache
-    cache = {
-        'notes': {'data': None, 'timestamp': 0, 'ttl': 300},
-        'followers': {'data': None, 'timestamp': 0, 'ttl': 600},
-        'note_details': {},
-    }
+    cache.clear()
     
     # 检查是否是AJAX请求
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -595,76 +938,234 @@ def clear_cache():
     return redirect(url_for('index'))
 
 
+@app.route('/api/stats')
+def api_stats():
+    """API端点：获取运行统计数据"""
+    stats = {'http': http_session.get_stats(), 'cache': cache.stats(), 'store': store.stats(), 'images': images.stats()}
+    if api_client:
+        stats['sign'] = api_client.get_sign_stats()
+        stats['tokens'] = api_client.xsec_tokens.stats()
+        stats['upstream'] = api_client.limiter.stats()
+        stats['sync'] = note_sync.stats()
+    stats['metrics'] = metrics.stats()
+    stats['scheduler'] = scheduler.status()
+    return jsonify(stats)
+
+
+@app.route('/api/metrics/<note_id>')
+def api_note_metrics(note_id):
+    """
+    API端点：笔记互动数据的历史，只读取本地存储，不请求上游
+    
+    参数 days 为最近的天数（默认30），或用 start / end 指定时间戳范围；
+    step 为降采样的秒数，raw=1 时返回全部原始快照
+    """
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - request.args.get('days', METRICS_DEFAULT_DAYS, type=float) * 86400,
+                             type=float)
+    if request.args.get('raw', type=int):
+        points = metrics.range(note_id, start, end)
+    else:
+        points = metrics.downsample(note_id, start, end, request.args.get('step', type=int))
+    return jsonify({
+        "note_id": note_id,
+        "start": int(start),
+        "end": int(end),
+        "latest": metrics.latest(note_id),
+        "points": points
+    })
+
+
+def compute_analytics(weeks, top_n):
+    """用同步到本地的全部笔记和互动数据快照计算统计数据"""
+    notes = [note_sync.notes[note_id] for note_id in note_sync.order if note_id in note_sync.notes]
+    return analytics.compute(notes, metrics.columns(), weeks=weeks, top_n=top_n)
+
+
+@app.route('/api/analytics')
+def api_analytics():
+    """
+    API端点：全部笔记的汇总、按周统计、排行和分位数，只读取本地数据，不请求上游
+    
+    参数 weeks 为按周统计的周数，top 为排行的笔记数
+    """
+    if not api_client:
+        if not init_api_client():
+            return jsonify({"error": "未登录"}), 401
+    if not analytics.available():
+        return jsonify({"error": "需要安装 NumPy"}), 501
+    
+    weeks = min(max(request.args.get('weeks', analytics.DEFAULT_WEEKS, type=int), 1), 104)
+    top_n = min(max(request.args.get('top', analytics.DEFAULT_TOP_N, type=int), 1), 100)
+    try:
+        result = cache.get_or_revalidate('analytics', lambda: compute_analytics(weeks, top_n),
+                                         key=f"{weeks}:{top_n}")
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": f"计算统计数据失败: {e}"}), 500
+
+
+def image_response(image):
+    """
+    返回缓存的图片，支持 ETag / Last-Modified 条件请求和 Range 请求
+    
+    只在磁盘上的图片用 send_file 直接发送文件，不读入内存
+    """
+    if image.content is None:
+        return send_file(image.path, mimetype=image.content_type, conditional=True,
+                         etag=image.etag, last_modified=image.created, max_age=IMAGE_BROWSER_MAX_AGE)
+    
+    resp = Response(image.content, content_type=image.content_type)
+    resp.set_etag(image.etag)
+    resp.last_modified = image.created
+    resp.cache_control.public = True
+    resp.cache_control.max_age = IMAGE_BROWSER_MAX_AGE
+    return resp.make_conditional(request, accept_ranges=True, complete_length=image.size)
+
+
+def fetch_image(image_url):
+    """
+    下载整张图片写入缓存，返回缓存的图片
+    
+    同一图片已在下载时等待其完成，不重复下载
+    """
+    if not images.claim(image_url):
+        image = images.wait(image_url, timeout=IMAGE_WAIT_TIMEOUT)
+        if image is None:
+            raise IOError("等待其他请求下载图片失败")
+        return image
+    
+    try:
+        if not images.acquire_fetch_slot():
+            raise IOError("图片下载排队超时")
+        try:
+            response = http_session.get(image_url, headers=IMAGE_REQUEST_HEADERS, timeout=10, stream=True)
+            try:
+                if response.status_code != 200:
+                    raise IOError(f"获取图片失败，状态码: {response.status_code}")
+                writer = images.open_writer(image_url, response.headers.get('Content-Type', 'image/jpeg'))
+                try:
+                    for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                        writer.write(chunk)
+                    return writer.commit()
+                finally:
+                    writer.abort()
+            finally:
+                response.close()
+        finally:
+            images.release_fetch_slot()
+    finally:
+        images.release(image_url)
+
+
+def get_thumbnail(image_url, width, fmt):
+    """获取缩略图，没有缓存时从原图生成（在缩放线程池中执行）并写入缓存"""
+    variant = thumbnails.variant_name(width, fmt)
+    image = images.get(image_url, variant)
+    if image is not None:
+        return image
+    
+    # 同一缩略图同时只生成一次
+    if not images.claim(image_url, variant):
+        image = images.wait(image_url, variant, timeout=IMAGE_WAIT_TIMEOUT)
+        if image is None:
+            raise IOError("等待其他请求生成缩略图失败")
+        return image
+    try:
+        original = images.get(image_url) or fetch_image(image_url)
+        data, content_type = thumbnails.submit(original.read(), width, fmt).result()
+        return images.put(image_url, data, content_type, variant)
+    finally:
+        images.release(image_url, variant)
+
+
+def stream_image(upstream, writer):
+    """把上游响应逐块转发给客户端，同时写入缓存，完成后提交缓存"""
+    for chunk in upstream.iter_content(IMAGE_CHUNK_SIZE):
+        writer.write(chunk)
+        yield chunk
+    writer.commit()
+
+
 @app.route('/proxy_image')
 def proxy_image():
-    """代理获取小红书图片"""
+    """
+    代理获取小红书图片
+    
+    可选参数 w（宽度）和 fmt（webp / jpeg）返回缩放转码后的图片，未安装 Pillow 时返回原图
+    """
     image_url = request.args.get('url', '')
     if not image_url:
         return "No URL provided", 400
     
-    # 生成缓存键
-    cache_key = hashlib.md5(image_url.encode()).hexdigest()
-    cache_path = os.path.join('cache', 'images', cache_key)
-    
-    # 确保缓存目录存在
-    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    
-    # 检查是否有缓存
-    if os.path.exists(cache_path):
-        # 获取文件修改时间
-        file_time = os.path.getmtime(cache_path)
-        # 如果缓存未过期（7天）
-        if time.time() - file_time < 7 * 24 * 60 * 60:
-            with open(cache_path, 'rb') as f:
-                content = f.read()
-                # 根据文件扩展名判断内容类型
-                content_type = 'image/jpeg'  # 默认JPEG
-                if image_url.lower().endswith('.png'):
-                    content_type = 'image/png'
-                elif image_url.lower().endswith('.gif'):
-                    content_type = 'image/gif'
-                elif image_url.lower().endswith('.webp'):
-                    content_type = 'image/webp'
-                
-                resp = Response(content, content_type=content_type)
-                resp.headers['Cache-Control'] = 'public, max-age=86400'  # 缓存一天
-                return resp
+    # 请求缩略图
+    variant = thumbnails.normalize(request.args.get('w', type=int), request.args.get('fmt'))
+    if variant and thumbnails.available():
+        try:
+            return image_response(get_thumbnail(image_url, *variant))
+        except Exception as e:
+            print(f"生成缩略图失败，返回原图: {e}")
     
+    # 检查是否有缓存（内存或磁盘），缓存文件在发送前被清理时当作未命中，重新下载
     try:
-        # 设置请求头，模拟浏览器请求
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-            "Referer": "https://www.xiaohongshu.com/",
-            "Origin": "https://www.xiaohongshu.com",
-            "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
-        }
-        
-        # 获取图片
-        response = requests.get(image_url, headers=headers, timeout=10)
+        image = images.get(image_url)
+        if image is not None:
+            return image_response(image)
+    except FileNotFoundError:
+        pass
+    
+    # 其他请求正在下载同一张图片时，等待其写入缓存
+    if not images.claim(image_url):
+        try:
+            image = images.wait(image_url, timeout=IMAGE_WAIT_TIMEOUT)
+            if image is not None:
+                return image_response(image)
+        except FileNotFoundError:
+            pass
+        return Response("Failed to fetch image", status=400)
+    
+    # 限制同时请求图片CDN的数量，超出时排队
+    if not images.acquire_fetch_slot():
+        images.release(image_url)
+        return Response("Too many image requests", status=503)
+    
+    def finish():
+        images.release_fetch_slot()
+        images.release(image_url)
+    
+    try:
+        # 获取图片，不把整个响应读入内存
+        response = http_session.get(image_url, headers=IMAGE_REQUEST_HEADERS, timeout=10, stream=True)
         
         if response.status_code == 200:
-            # 获取图片内容类型
+            # 获取图片内容类型，边转发边写入缓存
             content_type = response.headers.get('Content-Type', 'image/jpeg')
+            writer = images.open_writer(image_url, content_type)
             
-            # 保存到缓存
-            with open(cache_path, 'wb') as f:
-                f.write(response.content)
-            
-            # 返回图片，设置缓存控制
-            resp = Response(response.content, content_type=content_type)
-            resp.headers['Cache-Control'] = 'public, max-age=86400'  # 缓存一天
+            # 响应结束（包括客户端中断）时关闭上游连接、放弃未完成的缓存并释放名额
+            body = ClosingIterator(stream_image(response, writer), [writer.abort, response.close, finish])
+            resp = Response(body, content_type=content_type)
+            if response.headers.get('Content-Length'):
+                resp.headers['Content-Length'] = response.headers['Content-Length']
+            resp.cache_control.public = True
+            resp.cache_control.max_age = IMAGE_BROWSER_MAX_AGE
             return resp
         else:
             print(f"获取图片失败，状态码: {response.status_code}")
+            response.close()
+            finish()
             return Response("Failed to fetch image", status=400)
     except Exception as e:
         print(f"获取图片异常: {e}")
+        finish()
         return Response(f"Error: {str(e)}", status=500)
 
 
 if __name__ == '__main__':
-    # 初始化API客户端
-    init_api_client()
+    # 调试模式的重载器会在子进程中重新运行本模块，只在实际处理请求的子进程中初始化，
+    # 避免监视文件的父进程也启动一套后台调度、签名浏览器和数据库写入
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_api_client()
     
     # 启动Flask应用，修改端口为5001
     app.run(debug=True, host='0.0.0.0', port=5002) 
\ No newline at end of file
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+缓存管理模块
+线程安全的分命名空间缓存，每个命名空间有独立的有效期和条目上限，
+超出上限时按最近最少使用（LRU）淘汰，并统计命中、未命中和淘汰次数。
+同一个键的并发未命中只会触发一次计算（single-flight），其他调用方等待并共享结果。
+命名空间可以设置陈旧窗口（stale_ttl）：过期但仍在窗口内的数据立即返回，同时在后台重新计算。
+设置了持久化存储时，persist 的命名空间写入时同步写入存储（在锁外按内存中的修改顺序执行），内存未命中时从存储中加载
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_KEY = 'default'  # 只有一条数据的命名空间使用的键
+DEFAULT_TTL = 300  # 默认有效期（秒）
+DEFAULT_MAX_ENTRIES = 1000  # 默认条目上限
+DEFAULT_STALE_TTL = 0  # 默认陈旧窗口（秒），0表示过期后不再使用
+
+
+class CacheEntry:
+    """缓存条目"""
+
+    __slots__ = ('value', 'timestamp', 'ttl', 'stale_ttl')
+
+    def __init__(self, value, timestamp: float, ttl: float, stale_ttl: float = DEFAULT_STALE_TTL):
+        self.value = value
+        self.timestamp = timestamp
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    @property
+    def age(self) -> float:
+        """距离写入的秒数"""
+        return time.time() - self.timestamp
+
+    def is_fresh(self) -> bool:
+        return self.age < self.ttl
+
+    def is_usable(self) -> bool:
+        """未过期，或已过期但仍在陈旧窗口内"""
+        return self.age < self.ttl + self.stale_ttl
+
+
+class CacheNamespace:
+    """一个命名空间的数据和统计"""
+
+    def __init__(self, name: str, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 stale_ttl: float = DEFAULT_STALE_TTL, persist: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.persist = persist
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.revalidations = 0
+        self.revalidation_errors = 0
+        self.restored = 0
+        self.version = 0  # 每次写入、删除或清空时加一，用于判断从存储加载期间是否有修改
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "revalidations": self.revalidations,
+            "revalidation_errors": self.revalidation_errors,
+            "persist": self.persist,
+            "restored": self.restored,
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+        }
+
+
+class _Call:
+    """一次正在进行的计算"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用
+
+    同一时刻对同一个键只有一个调用方（leader）真正执行函数，
+    其他调用方等待它完成并得到相同的结果或异常
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}  # 分组 -> {"calls": 执行次数, "coalesced": 被合并的调用次数}
+
+    def _group_stats(self, key) -> Dict:
+        group = key[0] if isinstance(key, tuple) else key
+        if group not in self._stats:
+            self._stats[group] = {"calls": 0, "coalesced": 0}
+        return self._stats[group]
+
+    def do(self, key, func: Callable[[], Any]) -> Any:
+        """执行func，如果相同key的调用正在进行，则等待其结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._group_stats(key)["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._group_stats(key)["calls"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key) -> bool:
+        """相同key的调用是否正在进行"""
+        with self._lock:
+            return key in self._calls
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {group: dict(counts) for group, counts in self._stats.items()}
+            stats["in_flight"] = len(self._calls)
+            return stats
+
+
+class CacheManager:
+    """分命名空间的线程安全缓存"""
+
+    def __init__(self, store=None):
+        """
+        参数:
+            store: 可选，持久化存储（persistent_store.PersistentStore）
+        """
+        self._lock = threading.RLock()
+        self._namespaces = {}
+        self.flights = SingleFlight()
+        self.store = store
+        # 待执行的存储写入，在持有锁修改内存时入队，保证写入存储的顺序与内存中的修改顺序一致
+        self._writes = deque()
+        self._write_lock = threading.Lock()  # 同一时刻只有一个线程按顺序执行存储写入
+
+    def register(self, name: str, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 stale_ttl: float = DEFAULT_STALE_TTL, persist: bool = False) -> CacheNamespace:
+        """
+        注册命名空间，已存在时更新其配置
+
+        参数:
+            name: 命名空间名称
+            ttl: 条目有效期（秒）
+            max_entries: 条目上限，超出时淘汰最久未使用的条目
+            stale_ttl: 过期后仍可返回旧数据的时长（秒），超过 ttl + stale_ttl 后必须重新计算
+            persist: 是否写入持久化存储，需要创建 CacheManager 时传入 store
+        """
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = CacheNamespace(name, ttl, max_entries, stale_ttl, persist)
+                self._namespaces[name] = namespace
+            else:
+                namespace.ttl = ttl
+                namespace.max_entries = max_entries
+                namespace.stale_ttl = stale_ttl
+                namespace.persist = persist
+                for entry in namespace.entries.values():
+                    entry.stale_ttl = stale_ttl
+                self._evict(namespace)
+            return namespace
+
+    def _namespace(self, name: str) -> CacheNamespace:
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = self.register(name)
+        return namespace
+
+    def _persisted(self, namespace: CacheNamespace) -> bool:
+        return namespace.persist and self.store is not None
+
+    def _lookup(self, name: str, key: str) -> Optional[CacheEntry]:
+        """
+        查找内存中的条目，不存在时从持久化存储中加载
+
+        读取存储不持有锁，避免磁盘读写阻塞其他键；超出陈旧窗口的记录不加载，由 purge_expired 清理
+        """
+        with self._lock:
+            namespace = self._namespace(name)
+            entry = namespace.entries.get(key)
+            if entry is not None or not self._persisted(namespace):
+                return entry
+            version = namespace.version
+        # 先执行已入队的写入，读到的记录不会早于内存中已有的修改
+        self._flush_writes()
+        row = self.store.get(name, key)
+        if row is None:
+            return None
+        value, timestamp, ttl = row
+        with self._lock:
+            namespace = self._namespace(name)
+            # 读取期间可能已有其他调用方写入或加载
+            current = namespace.entries.get(key)
+            if current is not None or namespace.version != version:
+                # 命名空间在读取期间被修改过（可能删除了该键），读到的记录可能已经过时，不加载
+                return current
+            entry = CacheEntry(value, timestamp, ttl if ttl is not None else namespace.ttl, namespace.stale_ttl)
+            if not entry.is_usable():
+                return None
+            namespace.entries[key] = entry
+            namespace.restored += 1
+            self._evict(namespace)
+            return entry
+
+    def get_entry(self, name: str, key: str = DEFAULT_KEY) -> Optional[CacheEntry]:
+        """获取条目（可能已过期），不影响命中统计"""
+        return self._lookup(name, key)
+
+    def get(self, name: str, key: str = DEFAULT_KEY, default=None) -> Any:
+        """获取未过期的数据，超出陈旧窗口的条目会被删除"""
+        entry = self._lookup(name, key)
+        with self._lock:
+            namespace = self._namespace(name)
+            if entry is not None:
+                if entry.is_fresh():
+                    if key in namespace.entries:
+                        namespace.entries.move_to_end(key)
+                    namespace.hits += 1
+                    return entry.value
+                if not entry.is_usable():
+                    self._expire(namespace, key, entry)
+            namespace.misses += 1
+            return default
+
+    def get_stale(self, name: str, key: str = DEFAULT_KEY) -> Optional[CacheEntry]:
+        """
+        获取未过期或仍在陈旧窗口内的条目，不存在时返回None
+
+        返回条目而不是数据，调用方通过 entry.is_fresh() 判断是否需要重新计算
+        """
+        entry = self._lookup(name, key)
+        with self._lock:
+            namespace = self._namespace(name)
+            if entry is not None:
+                if entry.is_usable():
+                    if key in namespace.entries:
+                        namespace.entries.move_to_end(key)
+                    if entry.is_fresh():
+                        namespace.hits += 1
+                    else:
+                        namespace.stale_hits += 1
+                    return entry
+                self._expire(namespace, key, entry)
+            namespace.misses += 1
+            return None
+
+    def set(self, name: str, value, key: str = DEFAULT_KEY, ttl: Optional[float] = None):
+        """写入数据，ttl为空时使用命名空间的有效期，写入持久化存储时不持有锁"""
+        with self._lock:
+            namespace = self._namespace(name)
+            entry = CacheEntry(value, time.time(), ttl if ttl is not None else namespace.ttl, namespace.stale_ttl)
+            namespace.entries[key] = entry
+            namespace.entries.move_to_end(key)
+            namespace.version += 1
+            self._evict(namespace)
+            if self._persisted(namespace):
+                self._writes.append((self.store.set, (name, key, value, entry.timestamp, entry.ttl)))
+        self._flush_writes()
+
+    def delete(self, name: str, key: str = DEFAULT_KEY):
+        with self._lock:
+            namespace = self._namespace(name)
+            namespace.entries.pop(key, None)
+            namespace.version += 1
+            if self._persisted(namespace):
+                self._writes.append((self.store.delete, (name, key)))
+        self._flush_writes()
+
+    def _flush_writes(self):
+        """
+        按入队顺序执行存储写入，不持有缓存锁
+
+        其他线程正在写入时等待它完成，返回时本线程入队的写入都已执行
+        """
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    if not self._writes:
+                        return
+                    write, args = self._writes.popleft()
+                write(*args)
+
+    def _expire(self, namespace: CacheNamespace, key: str, entry: CacheEntry):
+        """从内存中删除超出陈旧窗口的条目，存储中的记录由 purge_expired 清理"""
+        if namespace.entries.get(key) is entry:
+            del namespace.entries[key]
+        namespace.expirations += 1
+
+    def age(self, name: str, key: str = DEFAULT_KEY) -> Optional[float]:
+        """条目写入后经过的秒数，不存在时返回None"""
+        entry = self.get_entry(name, key)
+        return entry.age if entry is not None else None
+
+    def is_fresh(self, name: str, key: str = DEFAULT_KEY) -> bool:
+        """条目是否存在且未过期，不影响命中统计"""
+        entry = self.get_entry(name, key)
+        return entry is not None and entry.is_fresh()
+
+    def get_or_compute(self, name: str, compute: Callable[[], Any], key: str = DEFAULT_KEY,
+                       ttl: Optional[float] = None, should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        获取未过期的数据，不存在时调用compute计算并写入
+
+        compute在锁外执行，不会阻塞其他键的读写；同一个键的并发未命中只计算一次。
+        返回None或should_cache返回False时不写入缓存
+        """
+        value = self.get(name, key)
+        if value is not None:
+            return value
+        return self.load(name, compute, key, ttl, should_cache)
+
+    def load(self, name: str, compute: Callable[[], Any], key: str = DEFAULT_KEY,
+             ttl: Optional[float] = None, should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        调用方已确认未命中时使用：合并并发计算并写入，不再计入命中统计
+        """
+        def load():
+            # 等待期间可能已有其他调用方写入
+            entry = self.get_entry(name, key)
+            if entry is not None and entry.is_fresh():
+                return entry.value
+            return self._compute_and_set(name, compute, key, ttl, should_cache)
+
+        return self.flights.do((name, key), load)
+
+    def get_or_revalidate(self, name: str, compute: Callable[[], Any], key: str = DEFAULT_KEY,
+                          ttl: Optional[float] = None, should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        stale-while-revalidate：未过期时直接返回；已过期但在陈旧窗口内时立即返回旧数据，
+        并在后台线程重新计算一次；没有可用数据时与 get_or_compute 相同，阻塞计算
+        """
+        entry = self.get_stale(name, key)
+        if entry is None:
+            return self.load(name, compute, key, ttl, should_cache)
+        if not entry.is_fresh():
+            self.revalidate(name, compute, key, ttl, should_cache)
+        return entry.value
+
+    def revalidate(self, name: str, compute: Callable[[], Any], key: str = DEFAULT_KEY,
+                   ttl: Optional[float] = None, should_cache: Optional[Callable[[Any], bool]] = None) -> bool:
+        """
+        在后台线程重新计算并写入，同一个键已有计算在进行时不再启动，返回是否启动了新的计算
+
+        计算失败时保留旧数据，直到超出陈旧窗口
+        """
+        if self.flights.in_flight((name, key)):
+            return False
+
+        def run():
+            try:
+                self.refresh(name, compute, key, ttl, should_cache)
+                with self._lock:
+                    self._namespace(name).revalidations += 1
+            except Exception as e:
+                with self._lock:
+                    self._namespace(name).revalidation_errors += 1
+                print(f"后台刷新缓存失败 {name}/{key}: {e}")
+
+        thread = threading.Thread(target=run, name=f"revalidate-{name}")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def refresh(self, name: str, compute: Callable[[], Any], key: str = DEFAULT_KEY,
+                ttl: Optional[float] = None, should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        忽略现有缓存重新计算并写入
+
+        与同一个键上正在进行的 get_or_compute / refresh 合并为一次计算
+        """
+        return self.flights.do((name, key), lambda: self._compute_and_set(name, compute, key, ttl, should_cache))
+
+    def _compute_and_set(self, name, compute, key, ttl, should_cache):
+        value = compute()
+        if value is not None and (should_cache is None or should_cache(value)):
+            self.set(name, value, key, ttl)
+        return value
+
+    def clear(self, name: Optional[str] = None):
+        """清空指定命名空间，name为空时清空全部，统计数据保留"""
+        with self._lock:
+            namespaces = [self._namespace(name)] if name else list(self._namespaces.values())
+            for namespace in namespaces:
+                namespace.entries.clear()
+                namespace.version += 1
+                if self._persisted(namespace):
+                    self._writes.append((self.store.clear, (namespace.name,)))
+        self._flush_writes()
+
+    def purge_expired(self, name: Optional[str] = None) -> int:
+        """删除超出陈旧窗口的条目，返回删除的数量"""
+        removed = 0
+        with self._lock:
+            namespaces = [self._namespace(name)] if name else list(self._namespaces.values())
+            for namespace in namespaces:
+                for key in [key for key, entry in namespace.entries.items() if not entry.is_usable()]:
+                    del namespace.entries[key]
+                    namespace.expirations += 1
+                    removed += 1
+            persisted = [(namespace.name, namespace.ttl + namespace.stale_ttl)
+                         for namespace in namespaces if self._persisted(namespace)]
+        # 内存淘汰的条目仍保留在存储中，按命名空间的窗口清理
+        for namespace_name, max_age in persisted:
+            removed += self.store.purge(namespace_name, max_age)
+        return removed
+
+    def _evict(self, namespace: CacheNamespace):
+        """先删除超出陈旧窗口的条目，仍超出上限时淘汰最久未使用的条目"""
+        if len(namespace.entries) <= namespace.max_entries:
+            return
+        for key in [key for key, entry in namespace.entries.items() if not entry.is_usable()]:
+            del namespace.entries[key]
+            namespace.expirations += 1
+        while len(namespace.entries) > namespace.max_entries:
+            namespace.entries.popitem(last=False)
+            namespace.evictions += 1
+
+    def stats(self) -> Dict:
+        """返回各命名空间的统计数据，coalesced 为等待其他调用方结果的次数"""
+        flights = self.flights.stats()
+        with self._lock:
+            stats = {}
+            for name, namespace in self._namespaces.items():
+                stats[name] = namespace.stats()
+                stats[name]["computes"] = flights.get(name, {}).get("calls", 0)
+                stats[name]["coalesced"] = flights.get(name, {}).get("coalesced", 0)
+            return stats
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游HTTP连接管理模块
+所有访问小红书接口和图片CDN的同步请求共享同一个 requests.Session，
+按主机维护长连接池，避免每次请求重新建立 TCP+TLS 连接，并统计连接复用和握手耗时
+"""
+
+import time
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 连接池配置
+POOL_CONNECTIONS = 10  # 缓存的主机连接池数量
+POOL_MAXSIZE = 20  # 每个主机保持的最大连接数
+CONNECT_TIMEOUT = 5  # 建立连接超时（秒）
+READ_TIMEOUT = 10  # 读取响应超时（秒）
+
+
+class ConnectionStats:
+    """按主机统计请求数、新建连接数和握手耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host: str) -> Dict:
+        if host not in self._hosts:
+            self._hosts[host] = {"requests": 0, "connections": 0, "handshake_ms": 0.0, "max_handshake_ms": 0.0}
+        return self._hosts[host]
+
+    def record_request(self, host: str):
+        with self._lock:
+            self._host(host)["requests"] += 1
+
+    def record_connect(self, host: str, elapsed_ms: float):
+        with self._lock:
+            entry = self._host(host)
+            entry["connections"] += 1
+            entry["handshake_ms"] += elapsed_ms
+            entry["max_handshake_ms"] = max(entry["max_handshake_ms"], elapsed_ms)
+
+    def snapshot(self) -> Dict:
+        """返回统计数据快照，reused 为复用已有连接的请求数"""
+        with self._lock:
+            hosts = {}
+            for host, entry in self._hosts.items():
+                hosts[host] = {
+                    "requests": entry["requests"],
+                    "connections": entry["connections"],
+                    "reused": max(0, entry["requests"] - entry["connections"]),
+                    "avg_handshake_ms": round(entry["handshake_ms"] / entry["connections"], 2) if entry["connections"] else 0,
+                    "max_handshake_ms": round(entry["max_handshake_ms"], 2),
+                }
+            return hosts
+
+
+stats = ConnectionStats()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            stats.record_connect(self.host, (time.perf_counter() - start) * 1000)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # 包含 TCP 连接和 TLS 握手
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            stats.record_connect(self.host, (time.perf_counter() - start) * 1000)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """按主机复用长连接的适配器，新建连接时记录握手耗时"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        stats.record_request(requests.utils.urlparse(request.url).hostname or "")
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        return super().send(request, **kwargs)
+
+
+def mount(session: requests.Session) -> requests.Session:
+    """为已有的 Session 挂载共享配置的连接池适配器"""
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, PooledAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE))
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """获取进程内共享的 Session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = mount(requests.Session())
+        return _session
+
+
+def configure(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+              connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None):
+    """
+    修改连接池配置，对之后挂载的适配器和共享 Session 生效
+
+    参数:
+        pool_connections: 缓存的主机连接池数量
+        pool_maxsize: 每个主机保持的最大连接数
+        connect_timeout: 建立连接超时（秒）
+        read_timeout: 读取响应超时（秒）
+    """
+    global POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT
+    if pool_connections:
+        POOL_CONNECTIONS = pool_connections
+    if pool_maxsize:
+        POOL_MAXSIZE = pool_maxsize
+    if connect_timeout:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout:
+        READ_TIMEOUT = read_timeout
+    with _session_lock:
+        if _session is not None:
+            mount(_session)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """通过共享 Session 发送GET请求"""
+    return get_session().get(url, **kwargs)
+
+
+def get_stats() -> Dict:
+    """返回连接池配置和各主机的连接统计"""
+    return {
+        "pool_connections": POOL_CONNECTIONS,
+        "pool_maxsize": POOL_MAXSIZE,
+        "timeout": [CONNECT_TIMEOUT, READ_TIMEOUT],
+        "hosts": stats.snapshot(),
+    }
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+图片缓存模块
+两级缓存：内存中按最近最少使用保存较小的热点图片（首页封面），
+磁盘上保存全部图片，内容类型等元数据写在同名的 .json 文件中，
+后台清理线程删除过期文件，并在总大小超出上限时按最近访问时间淘汰。
+下载时边接收边写入临时文件，完成后原子地重命名为缓存文件。
+同一张图片的缩略图等变体按 variant 区分，与原图保存在同一目录。
+同一张图片同时只下载一次，其他请求等待下载完成后读取缓存；同时请求图片CDN的数量有上限，超出时排队
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+IMAGE_CACHE_DIR = os.path.join('cache', 'images')  # 磁盘缓存目录
+IMAGE_MAX_AGE = 7 * 24 * 60 * 60  # 图片有效期（秒）
+MEMORY_MAX_BYTES = 32 * 1024 * 1024  # 内存缓存总大小上限
+MEMORY_MAX_ITEM_BYTES = 1024 * 1024  # 超过该大小的图片只放在磁盘上
+DISK_MAX_BYTES = 1024 * 1024 * 1024  # 磁盘缓存总大小上限
+SWEEP_INTERVAL = 10 * 60  # 后台清理间隔（秒）
+META_SUFFIX = '.json'  # 元数据文件后缀
+PART_SUFFIX = '.part'  # 下载中的临时文件后缀
+PART_MAX_AGE = 60 * 60  # 超过该时间的临时文件视为中断的下载，由清理线程删除
+MAX_CONCURRENT_FETCHES = 6  # 同时请求图片CDN的最大数量
+FETCH_QUEUE_TIMEOUT = 15  # 排队等待下载名额的最长时间（秒）
+
+# 文件头到内容类型的对应关系，用于没有元数据的旧缓存文件
+_MAGIC_TYPES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def sniff_content_type(head: bytes, default: str = 'image/jpeg') -> str:
+    """根据文件头判断图片类型"""
+    for magic, content_type in _MAGIC_TYPES:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return default
+
+
+class CachedImage:
+    """一张缓存的图片，content 为内存中的数据，只在磁盘上时为None"""
+
+    __slots__ = ('key', 'path', 'content', 'content_type', 'size', 'created')
+
+    def __init__(self, key: str, path: str, content: Optional[bytes], content_type: str, size: int, created: float):
+        self.key = key
+        self.path = path
+        self.content = content
+        self.content_type = content_type
+        self.size = size
+        self.created = created
+
+    @property
+    def etag(self) -> str:
+        """由缓存键、大小和写入时间生成，访问时更新文件时间不会改变"""
+        return f"{self.key}-{self.size}-{int(self.created)}"
+
+    def read(self) -> bytes:
+        if self.content is not None:
+            return self.content
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class ImageWriter:
+    """
+    边下载边写入缓存的写入器
+
+    数据先写入临时文件，commit 时写入元数据并重命名为缓存文件，
+    下载中断时调用 abort 删除临时文件，不会留下不完整的缓存
+    """
+
+    def __init__(self, cache: 'ImageCache', url: str, content_type: str, variant: str = ''):
+        self.cache = cache
+        self.url = url
+        self.content_type = content_type
+        self.key = cache.make_key(url, variant)
+        fd, self.temp_path = tempfile.mkstemp(prefix=self.key + '.', suffix=PART_SUFFIX, dir=cache.directory)
+        self._file = os.fdopen(fd, 'wb')
+        self._chunks = []  # 较小的图片同时保留在内存中，完成后放入内存缓存
+        self.size = 0
+        self.closed = False
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.size += len(chunk)
+        if self._chunks is not None:
+            if self.size <= self.cache.memory_max_item_bytes:
+                self._chunks.append(chunk)
+            else:
+                self._chunks = None
+
+    def commit(self) -> CachedImage:
+        """完成写入，返回缓存的图片"""
+        self._file.close()
+        self.closed = True
+        content = b''.join(self._chunks) if self._chunks is not None else None
+        return self.cache._commit(self, content)
+
+    def abort(self):
+        """放弃写入并删除临时文件"""
+        if self.closed:
+            return
+        self.closed = True
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ImageCache:
+    """内存 + 磁盘两级图片缓存"""
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_age: float = IMAGE_MAX_AGE,
+                 memory_max_bytes: int = MEMORY_MAX_BYTES, memory_max_item_bytes: int = MEMORY_MAX_ITEM_BYTES,
+                 disk_max_bytes: int = DISK_MAX_BYTES, max_concurrent_fetches: int = MAX_CONCURRENT_FETCHES):
+        self.directory = directory
+        self.max_age = max_age
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_item_bytes = memory_max_item_bytes
+        self.disk_max_bytes = disk_max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._sweeper = None
+        self._downloads = {}  # 缓存键 -> 下载完成时触发的Event
+        self._fetch_slots = threading.BoundedSemaphore(max_concurrent_fetches)
+        self.max_concurrent_fetches = max_concurrent_fetches
+        self._active_fetches = 0
+        self._stats = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "stored": 0,
+            "memory_evictions": 0, "disk_evictions": 0, "expired": 0, "sweeps": 0,
+            "coalesced": 0, "fetches": 0, "queued": 0, "queue_timeouts": 0,
+        }
+
+    @staticmethod
+    def make_key(url: str, variant: str = '') -> str:
+        key = hashlib.md5(url.encode()).hexdigest()
+        return f"{key}.{variant}" if variant else key
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _remember(self, image: CachedImage):
+        """放入内存缓存，超出上限时淘汰最久未使用的图片"""
+        if image.content is None or image.size > self.memory_max_item_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(image.key, None)
+            if old is not None:
+                self._memory_bytes -= old.size
+            self._memory[image.key] = image
+            self._memory_bytes += image.size
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size
+                self._stats["memory_evictions"] += 1
+
+    def _forget(self, key: str):
+        with self._lock:
+            image = self._memory.pop(key, None)
+            if image is not None:
+                self._memory_bytes -= image.size
+
+    def _read_meta(self, path: str) -> Optional[Dict]:
+        """读取元数据，没有元数据文件时返回None，内容损坏时返回空字典"""
+        try:
+            with open(path + META_SUFFIX, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            return {}
+        return meta if isinstance(meta, dict) else {}
+
+    @staticmethod
+    def _created_at(meta: Optional[Dict], mtime: float) -> Optional[float]:
+        """缓存的写入时间，没有元数据或缺少该字段时使用文件修改时间，元数据损坏时返回None"""
+        if meta is None:
+            return mtime
+        created = meta.get("created", mtime) if meta else None
+        if isinstance(created, bool) or not isinstance(created, (int, float)):
+            return None
+        return created
+
+    def _write_meta(self, path: str, url: str, content_type: str, size: int, created: float):
+        fd, temp_path = tempfile.mkstemp(suffix=PART_SUFFIX, dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"url": url, "content_type": content_type, "size": size, "created": created}, f)
+        os.replace(temp_path, path + META_SUFFIX)
+
+    def _remove_files(self, path: str):
+        for file_path in (path, path + META_SUFFIX):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, url: str, variant: str = '') -> Optional[CachedImage]:
+        """
+        获取未过期的缓存图片，先查内存再查磁盘，都没有时返回None
+
+        磁盘命中时更新文件的访问时间，用于按最近访问淘汰
+        """
+        key = self.make_key(url, variant)
+        now = time.time()
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None and now - image.created < self.max_age:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return image
+        if image is not None:
+            self._forget(key)
+
+        path = self.path_for(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        meta = self._read_meta(path)
+        created = self._created_at(meta, st.st_mtime)
+        if created is None or now - created >= self.max_age:
+            # 元数据损坏的缓存同样删除，重新下载
+            self._remove_files(path)
+            self._count("expired")
+            self._count("misses")
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                content = f.read() if st.st_size <= self.memory_max_item_bytes else None
+                head = content[:16] if content is not None else f.read(16)
+        except FileNotFoundError:
+            # 读取前被清理线程删除
+            self._count("misses")
+            return None
+        if meta:
+            content_type = meta.get("content_type") or sniff_content_type(head)
+        else:
+            # 旧版本没有元数据的缓存文件，补写元数据，保留原来的写入时间
+            content_type = sniff_content_type(head)
+            self._write_meta(path, url, content_type, st.st_size, created)
+        os.utime(path)
+        image = CachedImage(key, path, content, content_type, st.st_size, created)
+        self._remember(image)
+        self._count("disk_hits")
+        return image
+
+    def contains(self, url: str, variant: str = '') -> bool:
+        """是否有未过期的缓存，不读取文件内容，也不计入命中统计"""
+        key = self.make_key(url, variant)
+        now = time.time()
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None and now - image.created < self.max_age:
+                return True
+        path = self.path_for(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return False
+        created = self._created_at(self._read_meta(path), mtime)
+        return created is not None and now - created < self.max_age
+
+    def put(self, url: str, content: bytes, content_type: str, variant: str = '') -> CachedImage:
+        """写入图片和元数据"""
+        writer = self.open_writer(url, content_type, variant)
+        try:
+            writer.write(content)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def open_writer(self, url: str, content_type: str, variant: str = '') -> ImageWriter:
+        """创建边下载边写入的写入器"""
+        return ImageWriter(self, url, content_type, variant)
+
+    def _commit(self, writer: ImageWriter, content: Optional[bytes]) -> CachedImage:
+        path = self.path_for(writer.key)
+        created = time.time()
+        # 先写元数据再替换数据文件，读取方不会看到没有元数据的新文件
+        self._write_meta(path, writer.url, writer.content_type, writer.size, created)
+        os.replace(writer.temp_path, path)
+        image = CachedImage(writer.key, path, content, writer.content_type, writer.size, created)
+        self._forget(writer.key)
+        self._remember(image)
+        self._count("stored")
+        return image
+
+    def claim(self, url: str, variant: str = '') -> bool:
+        """
+        登记对图片的下载，返回调用方是否负责下载
+
+        返回False表示已有其他请求在下载，调用 wait 等待其完成；
+        返回True时调用方下载完成或失败后必须调用 release
+        """
+        key = self.make_key(url, variant)
+        with self._lock:
+            if key in self._downloads:
+                self._stats["coalesced"] += 1
+                return False
+            self._downloads[key] = threading.Event()
+            return True
+
+    def release(self, url: str, variant: str = ''):
+        """结束下载登记，唤醒等待的请求"""
+        with self._lock:
+            done = self._downloads.pop(self.make_key(url, variant), None)
+        if done is not None:
+            done.set()
+
+    def wait(self, url: str, variant: str = '', timeout: Optional[float] = None) -> Optional[CachedImage]:
+        """等待其他请求的下载完成，返回缓存的图片，下载失败或超时返回None"""
+        with self._lock:
+            done = self._downloads.get(self.make_key(url, variant))
+        if done is not None:
+            done.wait(timeout)
+        return self.get(url, variant)
+
+    def acquire_fetch_slot(self, timeout: float = FETCH_QUEUE_TIMEOUT) -> bool:
+        """获取请求图片CDN的名额，名额用完时排队等待，超时返回False"""
+        if not self._fetch_slots.acquire(blocking=False):
+            self._count("queued")
+            if not self._fetch_slots.acquire(timeout=timeout):
+                self._count("queue_timeouts")
+                return False
+        with self._lock:
+            self._active_fetches += 1
+            self._stats["fetches"] += 1
+        return True
+
+    def release_fetch_slot(self):
+        with self._lock:
+            self._active_fetches -= 1
+        self._fetch_slots.release()
+
+    def sweep(self) -> Dict:
+        """删除过期图片，总大小超出上限时按最近访问时间从旧到新淘汰"""
+        now = time.time()
+        files = []
+        total = 0
+        expired = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.endswith(META_SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+                if entry.name.endswith(PART_SUFFIX):
+                    if now - st.st_mtime >= PART_MAX_AGE:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                # 扫描期间文件被写入完成改名、淘汰或被其他请求删除，跳过即可
+                continue
+            created = self._created_at(self._read_meta(entry.path), st.st_mtime)
+            if created is None or now - created >= self.max_age:
+                self._remove_files(entry.path)
+                self._forget(entry.name)
+                expired += 1
+                continue
+            files.append((st.st_mtime, entry.path, entry.name, st.st_size))
+            total += st.st_size
+
+        evicted = 0
+        if total > self.disk_max_bytes:
+            # 内存中的热点图片访问时不更新文件时间，视为最近访问
+            with self._lock:
+                hot = set(self._memory)
+            files.sort(key=lambda item: (item[2] in hot, item[0]))
+            for _, path, key, size in files:
+                if total <= self.disk_max_bytes:
+                    break
+                self._remove_files(path)
+                self._forget(key)
+                total -= size
+                evicted += 1
+
+        self._count("expired", expired)
+        self._count("disk_evictions", evicted)
+        self._count("sweeps")
+        return {"expired": expired, "evicted": evicted, "disk_bytes": total}
+
+    def start_sweeper(self, interval: float = SWEEP_INTERVAL):
+        """启动后台清理线程，重复调用不会启动多个"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval,), name='image-cache-sweeper')
+            self._sweeper.daemon = True
+        self._sweeper.start()
+
+    def _sweep_loop(self, interval: float):
+        while True:
+            try:
+                result = self.sweep()
+                if result["expired"] or result["evicted"]:
+                    print(f"图片缓存清理: 过期{result['expired']}个，淘汰{result['evicted']}个，"
+                          f"磁盘占用{result['disk_bytes'] / 1024 / 1024:.1f}MB")
+            except Exception as e:
+                print(f"图片缓存清理失败: {e}")
+            time.sleep(interval)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["downloading"] = len(self._downloads)
+            stats["active_fetches"] = self._active_fetches
+        stats["max_concurrent_fetches"] = self.max_concurrent_fetches
+        stats["memory_max_bytes"] = self.memory_max_bytes
+        stats["disk_max_bytes"] = self.disk_max_bytes
+        return stats
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+笔记互动数据时序存储模块
+在本地 SQLite 中按（笔记ID, 时间）聚簇保存点赞、评论、收藏、分享数的快照，只追加不修改；
+数值没有变化的快照不重复写入，查询时按时间向前补齐，支持区间查询和按时间段降采样
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_FILE = os.path.join('cache', 'metrics.db')  # 默认数据库文件
+METRICS = ('likes', 'comments', 'collects', 'shares')  # 记录的指标
+INTERACT_FIELDS = {  # 指标 -> 笔记 interact_info 中的字段
+    'likes': 'liked_count',
+    'comments': 'comment_count',
+    'collects': 'collected_count',
+    'shares': 'share_count',
+}
+SNAPSHOT_KEEPALIVE = 24 * 60 * 60  # 数值没有变化时，距上一条超过该时长（秒）仍写入一条
+MAX_POINTS = 500  # 降采样最多返回的点数
+
+
+def parse_count(value) -> Optional[int]:
+    """解析接口返回的计数，支持 "1.2万"、"10万+" 这类格式，无法解析时返回None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().rstrip('+')
+    multiplier = 1
+    if text.endswith('万'):
+        text, multiplier = text[:-1], 10000
+    elif text.endswith('亿'):
+        text, multiplier = text[:-1], 100000000
+    try:
+        return int(float(text) * multiplier)
+    except ValueError:
+        return None
+
+
+def values_from_interact_info(interact_info) -> Dict[str, Optional[int]]:
+    """从笔记的 interact_info 中取出各项指标，缺少的指标为None"""
+    if not isinstance(interact_info, dict):
+        return {}
+    return {metric: parse_count(interact_info.get(field)) for metric, field in INTERACT_FIELDS.items()}
+
+
+class MetricsStore:
+    """线程安全的互动数据时序存储"""
+
+    def __init__(self, path: str = METRICS_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # WITHOUT ROWID 表按主键顺序存储，同一笔记的快照在磁盘上连续，区间查询只扫描一段
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " note_id TEXT NOT NULL,"
+            " ts INTEGER NOT NULL,"
+            " likes INTEGER,"
+            " comments INTEGER,"
+            " collects INTEGER,"
+            " shares INTEGER,"
+            " PRIMARY KEY (note_id, ts)) WITHOUT ROWID"
+        )
+        self._latest = None  # 笔记ID -> (时间, 各指标)，第一次写入时加载
+        self.writes = 0
+        self.skipped = 0
+
+    def _latest_values(self) -> Dict[str, Tuple[int, Tuple]]:
+        if self._latest is None:
+            # SQLite 中与 MAX() 同时查询的列取自最大值所在的行
+            rows = self._conn.execute(
+                "SELECT note_id, MAX(ts), likes, comments, collects, shares FROM snapshots GROUP BY note_id"
+            ).fetchall()
+            self._latest = {row[0]: (row[1], tuple(row[2:])) for row in rows}
+        return self._latest
+
+    def record(self, note_id: str, values: Dict, timestamp: Optional[float] = None) -> bool:
+        """记录一条快照，返回是否写入"""
+        return self.record_many([(note_id, values)], timestamp) > 0
+
+    def record_many(self, snapshots: Iterable[Tuple], timestamp: Optional[float] = None) -> int:
+        """
+        在一个事务中记录多条快照
+
+        参数:
+            snapshots: (笔记ID, 指标 -> 数值) 或 (笔记ID, 指标 -> 数值, 快照时间) 的序列，
+                缺少的指标沿用该笔记上一条快照的值；早于该笔记最新一条快照的数据不会写入
+            timestamp: 没有单独指定时间的快照使用的时间，默认为当前时间
+
+        返回:
+            写入的条数
+        """
+        default_ts = int(timestamp if timestamp is not None else time.time())
+        with self._lock:
+            latest = self._latest_values()
+            rows = []
+            for note_id, values, *rest in snapshots:
+                ts = int(rest[0]) if rest and rest[0] is not None else default_ts
+                previous = latest.get(note_id)
+                merged = []
+                for index, metric in enumerate(METRICS):
+                    value = parse_count(values.get(metric))
+                    if value is None and previous is not None:
+                        value = previous[1][index]
+                    merged.append(value)
+                merged = tuple(merged)
+                if not note_id or all(value is None for value in merged):
+                    continue
+                if previous is not None and (ts < previous[0] or
+                                             (merged == previous[1] and ts - previous[0] < SNAPSHOT_KEEPALIVE)):
+                    self.skipped += 1
+                    continue
+                latest[note_id] = (ts, merged)
+                rows.append((note_id, ts) + merged)
+            if rows:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO snapshots (note_id, ts, likes, comments, collects, shares)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+                self.writes += len(rows)
+        return len(rows)
+
+    @staticmethod
+    def _point(ts: int, values) -> Dict:
+        point = {"timestamp": ts}
+        point.update(zip(METRICS, values))
+        return point
+
+    def latest(self, note_id: str) -> Optional[Dict]:
+        """笔记最新的一条快照"""
+        with self._lock:
+            entry = self._latest_values().get(note_id)
+        return self._point(*entry) if entry is not None else None
+
+    def range(self, note_id: str, start: Optional[float] = None, end: Optional[float] = None) -> List[Dict]:
+        """返回 [start, end] 内的全部快照，按时间排序"""
+        start = int(start) if start is not None else 0
+        end = int(end) if end is not None else 2 ** 62
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, likes, comments, collects, shares FROM snapshots"
+                " WHERE note_id = ? AND ts >= ? AND ts <= ? ORDER BY ts",
+                (note_id, start, end)
+            ).fetchall()
+        return [self._point(row[0], row[1:]) for row in rows]
+
+    def downsample(self, note_id: str, start: float, end: float, step: Optional[float] = None) -> List[Dict]:
+        """
+        按时间段降采样，每段取最后一条快照，没有快照的时间段沿用之前的值
+
+        参数:
+            note_id: 笔记ID
+            start, end: 时间范围 [start, end]
+            step: 每段的秒数，默认按 MAX_POINTS 平均分段
+
+        返回:
+            每段一个点，timestamp 为该段的开始时间，第一条快照之前的时间段不返回
+        """
+        start, end = int(start), int(end)
+        if end < start:
+            return []
+        count = end - start + 1
+        step = max(int(step or 0), -(-count // MAX_POINTS), 1)
+        with self._lock:
+            baseline = self._conn.execute(
+                "SELECT likes, comments, collects, shares FROM snapshots"
+                " WHERE note_id = ? AND ts < ? ORDER BY ts DESC LIMIT 1",
+                (note_id, start)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT (ts - ?) / ? AS bucket, MAX(ts), likes, comments, collects, shares FROM snapshots"
+                " WHERE note_id = ? AND ts >= ? AND ts <= ? GROUP BY bucket",
+                (start, step, note_id, start, end)
+            ).fetchall()
+        buckets = {row[0]: tuple(row[2:]) for row in rows}
+        points = []
+        current = tuple(baseline) if baseline is not None else None
+        for bucket in range(-(-count // step)):
+            current = buckets.get(bucket, current)
+            if current is not None:
+                points.append(self._point(start + bucket * step, current))
+        return points
+
+    def columns(self) -> Dict[str, list]:
+        """按（笔记ID, 时间）顺序返回全部快照，每列一个列表，便于载入 NumPy 数组"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT note_id, ts, likes, comments, collects, shares FROM snapshots ORDER BY note_id, ts"
+            ).fetchall()
+        names = ("note_id", "ts") + METRICS
+        if not rows:
+            return {name: [] for name in names}
+        return {name: list(column) for name, column in zip(names, zip(*rows))}
+
+    def note_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._latest_values())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            notes = len(self._latest_values())
+        return {"rows": rows, "notes": notes, "writes": self.writes, "skipped": self.skipped}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
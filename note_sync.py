@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+笔记列表增量同步模块
+在本地保存当前用户的全部笔记及其顺序，平时只请求最新的一小页，遇到已同步过的笔记即停止；
+按较长的间隔做一次全量翻页，清理上游已删除的笔记
+"""
+
+import time
+import threading
+from typing import Dict, List, Optional
+
+PAGE_SIZE = 20  # 从本地返回的每页笔记数
+INCREMENTAL_PAGE_SIZE = PAGE_SIZE  # 增量同步每页的笔记数，与首页显示的笔记数相同，保证首页的数据每次都刷新
+INCREMENTAL_MAX_PAGES = 3  # 增量同步最多翻阅的页数，超出时改为全量同步
+FULL_SYNC_PAGE_SIZE = 30  # 全量同步每页的笔记数
+FULL_SYNC_INTERVAL = 6 * 60 * 60  # 全量同步的间隔（秒）
+
+
+def is_sticky(note: Dict) -> bool:
+    """是否为置顶笔记，置顶笔记总在列表最前面，不能作为增量同步的终点"""
+    interact_info = note.get("interact_info")
+    return isinstance(interact_info, dict) and bool(interact_info.get("sticky"))
+
+
+class NoteSync:
+    """
+    当前用户笔记列表的本地副本
+
+    notes 保存 笔记ID -> 笔记列表接口返回的笔记数据，fetched_at 保存每条笔记最后一次从上游获取的时间，
+    state 保存同步状态和笔记顺序（从新到旧），三者都可以是普通字典或 persistent_store.PersistentDict
+    """
+
+    def __init__(self, api, notes=None, state=None, fetched_at=None):
+        """
+        参数:
+            api: XhsSimpleApi 实例
+            notes: 笔记ID -> 笔记数据
+            state: 同步状态
+            fetched_at: 笔记ID -> 最后一次获取的时间戳
+        """
+        self.api = api
+        self.notes = notes if notes is not None else {}
+        self.state = state if state is not None else {}
+        self.fetched_at = fetched_at if fetched_at is not None else {}
+        self._lock = threading.Lock()
+        self._positions = None  # (顺序列表, 笔记ID -> 在该列表中的下标)，顺序变化时重建
+        self._stats = {"incremental_syncs": 0, "full_syncs": 0, "requests": 0,
+                       "added": 0, "updated": 0, "removed": 0, "errors": 0}
+
+    @property
+    def order(self) -> List[str]:
+        return self.state.get("order", [])
+
+    @property
+    def complete(self) -> bool:
+        """是否完成过一次全量同步，之后本地数据可以代替上游分页"""
+        return bool(self.state.get("complete"))
+
+    def _reset_for(self, user_id: str):
+        """切换用户时清空本地数据"""
+        if self.state.get("user_id") == user_id:
+            return
+        for note_id in list(self.notes):
+            del self.notes[note_id]
+        for note_id in list(self.fetched_at):
+            del self.fetched_at[note_id]
+        self.state["order"] = []
+        self.state["complete"] = False
+        self.state["last_full_sync"] = 0
+        self.state["user_id"] = user_id
+        self._positions = None
+
+    def _fetch(self, user_id: str, cursor: str, count: int) -> Dict:
+        self._stats["requests"] += 1
+        return self.api.get_user_notes_page(user_id, cursor, count)
+
+    def _merge(self, fetched: List[Dict], complete: bool = False):
+        """
+        把获取到的笔记合并到本地，内容没有变化的笔记不会重新写入
+
+        参数:
+            fetched: 按上游顺序排列的笔记，是从第一页开始的连续一段
+            complete: 是否为全量同步的完整结果，是时删除本地多出的笔记
+        """
+        ids = []
+        seen = set()
+        now = time.time()
+        for note in fetched:
+            note_id = note.get("note_id")
+            if not note_id or note_id in seen:
+                continue
+            seen.add(note_id)
+            ids.append(note_id)
+            self.fetched_at[note_id] = now
+            old = self.notes.get(note_id)
+            if old == note:
+                continue
+            self.notes[note_id] = note
+            self._stats["added" if old is None else "updated"] += 1
+
+        if complete:
+            for note_id in [note_id for note_id in self.notes if note_id not in seen]:
+                del self.notes[note_id]
+                self.fetched_at.pop(note_id, None)
+                self._stats["removed"] += 1
+            order = ids
+        else:
+            order = ids + [note_id for note_id in self.order if note_id not in seen]
+        if order != self.order:
+            self.state["order"] = order
+            self._positions = None
+
+    def _first_page_sync(self, user_id: str) -> Optional[str]:
+        """本地还没有数据时只获取第一页，尽快返回"""
+        page = self._fetch(user_id, "", PAGE_SIZE)
+        if page.get("error"):
+            return page["error"]
+        self._merge(page["notes"])
+        return None
+
+    def _incremental_sync(self, user_id: str) -> Optional[str]:
+        """只获取比本地更新的笔记，返回错误信息"""
+        fetched = []
+        cursor = ""
+        for _ in range(INCREMENTAL_MAX_PAGES):
+            page = self._fetch(user_id, cursor, INCREMENTAL_PAGE_SIZE)
+            if page.get("error"):
+                return page["error"]
+            fetched.extend(page["notes"])
+            # 遇到已同步过的非置顶笔记，说明更早的笔记本地都有
+            if any(note.get("note_id") in self.notes and not is_sticky(note) for note in page["notes"]):
+                break
+            if not page["has_more"] or not page["notes"] or page["cursor"] == cursor:
+                break
+            cursor = page["cursor"]
+        else:
+            # 新笔记太多，直接全量同步
+            return self._full_sync(user_id)
+        self._merge(fetched)
+        self._stats["incremental_syncs"] += 1
+        return None
+
+    def _full_sync(self, user_id: str) -> Optional[str]:
+        """翻阅全部笔记并删除本地多出的笔记，返回错误信息"""
+        fetched = []
+        for page in self.api.iter_user_note_pages(user_id, count=FULL_SYNC_PAGE_SIZE):
+            self._stats["requests"] += 1
+            if page.get("error"):
+                # 翻页中断时只合并已获取的部分，不删除笔记
+                self._merge(fetched)
+                return page["error"]
+            fetched.extend(page["notes"])
+        self._merge(fetched, complete=True)
+        self.state["complete"] = True
+        self.state["last_full_sync"] = time.time()
+        self._stats["full_syncs"] += 1
+        return None
+
+    def full_sync_due(self) -> bool:
+        return not self.complete or time.time() - self.state.get("last_full_sync", 0) >= FULL_SYNC_INTERVAL
+
+    def sync(self, user_id: str, full: bool = False) -> Dict:
+        """
+        同步笔记列表，本地没有数据时只获取第一页，需要由调用方另行安排全量同步
+
+        参数:
+            user_id: 用户ID
+            full: 是否强制全量同步
+
+        返回:
+            同步后的第一页，格式与 XhsSimpleApi.get_user_notes_page 相同，同步失败时带有error字段
+        """
+        with self._lock:
+            self._reset_for(user_id)
+            if full:
+                error = self._full_sync(user_id)
+            elif not self.order:
+                error = self._first_page_sync(user_id)
+            else:
+                error = self._incremental_sync(user_id)
+            if error:
+                self._stats["errors"] += 1
+            page = self._page(self.order, 0, PAGE_SIZE)
+        if error:
+            page["error"] = error
+        return page
+
+    def _page(self, order: List[str], start: int, count: int) -> Dict:
+        ids = order[start:start + count]
+        notes = [self.notes[note_id] for note_id in ids if note_id in self.notes]
+        # 没有完成全量同步时，本地之后可能还有未同步的笔记
+        has_more = start + count < len(order) or (not self.complete and bool(ids))
+        # 游标与上游一致，为本页最后一条笔记的ID
+        return {"notes": notes, "cursor": ids[-1] if ids else "", "has_more": has_more}
+
+    def page(self, cursor: str = "", count: int = PAGE_SIZE) -> Optional[Dict]:
+        """
+        从本地返回游标之后的一页笔记
+
+        返回:
+            与 XhsSimpleApi.get_user_notes_page 相同的一页，本地数据不完整或游标未知时返回None
+        """
+        # 不加同步锁，全量同步进行中时仍返回同步前的数据；
+        # 同步时顺序列表整体替换而不修改，先取出当前列表，下标和分页都基于同一个列表
+        if not self.complete:
+            return None
+        order = self.order
+        if not cursor:
+            return self._page(order, 0, count)
+        cached = self._positions
+        if cached is not None and cached[0] is order:
+            positions = cached[1]
+        else:
+            positions = {note_id: index for index, note_id in enumerate(order)}
+            self._positions = (order, positions)
+        index = positions.get(cursor)
+        if index is None:
+            return None
+        return self._page(order, index + 1, count)
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats["notes"] = len(self.order)
+        stats["complete"] = self.complete
+        last_full_sync = self.state.get("last_full_sync")
+        stats["last_full_sync"] = (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_full_sync))
+                                   if last_full_sync else None)
+        return stats
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+持久化存储模块
+基于本地 SQLite（WAL 模式）保存缓存数据和 xsec_token，进程重启后可以直接使用，
+数据以 JSON 格式按（命名空间, 键）存储，并记录写入时间和有效期
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+STORE_FILE = os.path.join('cache', 'store.db')  # 默认数据库文件
+
+
+class PersistentStore:
+    """线程安全的 SQLite 键值存储"""
+
+    def __init__(self, path: str = STORE_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL 模式下读写互不阻塞，NORMAL 同步级别在掉电时最多丢失最近的事务
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " timestamp REAL NOT NULL,"
+            " ttl REAL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float, Optional[float]]]:
+        """读取条目，返回 (数据, 写入时间, 有效期)，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, timestamp, ttl FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            self.reads += 1
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0]), row[1], row[2]
+        except ValueError as e:
+            print(f"读取持久化数据失败 {namespace}/{key}: {e}")
+            self.errors += 1
+            return None
+
+    def set(self, namespace: str, key: str, value, timestamp: Optional[float] = None, ttl: Optional[float] = None):
+        """写入条目，数据无法序列化为JSON时跳过"""
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            print(f"数据无法持久化 {namespace}/{key}: {e}")
+            self.errors += 1
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, timestamp, ttl) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, payload, timestamp if timestamp is not None else time.time(), ttl)
+            )
+            self.writes += 1
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: Optional[str] = None):
+        """清空指定命名空间，namespace为空时清空全部"""
+        with self._lock:
+            if namespace:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+            else:
+                self._conn.execute("DELETE FROM entries")
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        """读取命名空间下的全部数据"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM entries WHERE namespace = ?", (namespace,)).fetchall()
+            self.reads += 1
+        result = {}
+        for key, value in rows:
+            try:
+                result[key] = json.loads(value)
+            except ValueError:
+                self.errors += 1
+        return result
+
+    def purge(self, namespace: str, max_age: float) -> int:
+        """删除写入时间早于 max_age 秒之前的条目，返回删除的数量"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND timestamp < ?",
+                (namespace, time.time() - max_age)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT namespace, COUNT(*) FROM entries GROUP BY namespace").fetchall()
+        return {
+            "path": self.path,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "entries": dict(rows),
+            "reads": self.reads,
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PersistentDict(MutableMapping):
+    """
+    持久化的字典，第一次访问时从存储中加载全部数据，写入时同步写入存储
+
+    用于保存 xsec_token 这类体积小、需要整体查询的数据
+    """
+
+    def __init__(self, store: PersistentStore, namespace: str):
+        self.store = store
+        self.namespace = namespace
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _loaded(self) -> Dict:
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self.store.items(self.namespace)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._loaded()[key]
+
+    def __setitem__(self, key, value):
+        data = self._loaded()
+        if data.get(key) == value:
+            return
+        data[key] = value
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        del self._loaded()[key]
+        self.store.delete(self.namespace, key)
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._loaded()))
+
+    def __len__(self) -> int:
+        return len(self._loaded())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游请求限流模块
+按接口类别使用令牌桶限制请求速率，上游拒绝请求时自动降低速率、成功后逐步恢复；
+连续失败达到阈值时熔断，熔断期间直接失败，不再请求上游，冷却后放行一个试探请求
+"""
+
+import time
+import random
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# 各接口类别的速率配置：类别 -> (每秒请求数, 桶容量)
+RATE_LIMITS = {
+    'notes': (1.0, 3),  # 笔记列表
+    'feed': (2.0, 4),  # 笔记详情
+    'comments': (2.0, 5),  # 评论
+    'followers': (0.5, 2),  # 关注者
+    'creator': (1.0, 3),  # 创作者平台（发布笔记）
+    'default': (2.0, 5),
+}
+MIN_RATE_RATIO = 0.1  # 降速后的速率下限（相对配置速率的比例）
+RECOVER_STEP_RATIO = 0.05  # 每次成功后恢复的速率（相对配置速率的比例）
+ACQUIRE_TIMEOUT = 30  # 等待令牌的最长时间（秒）
+FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+RESET_TIMEOUT = 60  # 熔断后多久放行试探请求（秒）
+
+
+class RateLimitedError(Exception):
+    """等待令牌超时"""
+
+
+class CircuitOpenError(Exception):
+    """熔断期间拒绝请求"""
+
+
+def backoff_delay(attempt: int, base: float = 0.5, maximum: float = 30.0) -> float:
+    """第attempt次（从0开始）重试前的等待时间：指数退避加随机抖动"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """自适应令牌桶：penalize 时速率减半，reward 时逐步恢复到配置速率"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout: float = ACQUIRE_TIMEOUT) -> float:
+        """
+        获取一个令牌，没有令牌时等待
+
+        返回:
+            等待的秒数，超时时抛出 RateLimitedError
+        """
+        deadline = time.monotonic() + timeout
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise RateLimitedError(f"等待请求名额超时（{timeout}秒）")
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self):
+        with self._lock:
+            self.rate = max(self.max_rate * MIN_RATE_RATIO, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVER_STEP_RATIO)
+
+
+class CircuitBreaker:
+    """熔断器：closed（正常） -> open（熔断） -> half_open（试探） -> closed / open"""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行请求，熔断冷却后只放行一个试探请求"""
+        with self._lock:
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.open_count += 1
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def release_probe(self):
+        """试探请求没有发出时归还试探名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """熔断剩余的秒数"""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+
+
+class UpstreamLimiter:
+    """按接口类别管理令牌桶和熔断器"""
+
+    def __init__(self, limits: Optional[Dict] = None, is_failure: Optional[Callable[[Exception], bool]] = None):
+        """
+        参数:
+            limits: 类别 -> (每秒请求数, 桶容量)，默认使用 RATE_LIMITS
+            is_failure: 判断异常是否表示上游拒绝（计入熔断），默认所有异常都计入
+        """
+        self.limits = dict(limits or RATE_LIMITS)
+        self.is_failure = is_failure or (lambda e: True)
+        self._buckets = {}
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint: str):
+        with self._lock:
+            if endpoint not in self._buckets:
+                rate, capacity = self.limits.get(endpoint, self.limits['default'])
+                self._buckets[endpoint] = TokenBucket(rate, capacity)
+                self._breakers[endpoint] = CircuitBreaker()
+                self._stats[endpoint] = {"requests": 0, "failures": 0, "throttled": 0, "wait_seconds": 0.0}
+            return self._buckets[endpoint], self._breakers[endpoint], self._stats[endpoint]
+
+    def before(self, endpoint: str, timeout: float = ACQUIRE_TIMEOUT):
+        """请求前调用：熔断时抛出 CircuitOpenError，否则等待令牌"""
+        bucket, breaker, stats = self._get(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{endpoint} 接口已熔断，{breaker.retry_after():.0f}秒后重试")
+        try:
+            waited = bucket.acquire(timeout)
+        except RateLimitedError:
+            # 没有发出请求，释放可能占用的试探名额
+            breaker.release_probe()
+            raise
+        with self._lock:
+            stats["requests"] += 1
+            if waited:
+                stats["throttled"] += 1
+                stats["wait_seconds"] += waited
+
+    def after(self, endpoint: str, error: Optional[Exception] = None):
+        """请求后调用，记录成功或失败"""
+        bucket, breaker, stats = self._get(endpoint)
+        if error is not None and self.is_failure(error):
+            bucket.penalize()
+            breaker.record_failure()
+            with self._lock:
+                stats["failures"] += 1
+        else:
+            bucket.reward()
+            breaker.record_success()
+
+    def cancel(self, endpoint: str):
+        """请求被取消、没有结果时调用，只归还可能占用的试探名额"""
+        self._get(endpoint)[1].release_probe()
+
+    @contextmanager
+    def guard(self, endpoint: str, timeout: float = ACQUIRE_TIMEOUT):
+        """限流并记录结果的上下文"""
+        self.before(endpoint, timeout)
+        try:
+            yield
+        except Exception as e:
+            self.after(endpoint, e)
+            raise
+        self.after(endpoint)
+
+    def is_open(self, endpoint: str) -> bool:
+        return self._get(endpoint)[1].state == 'open'
+
+    def stats(self) -> Dict:
+        with self._lock:
+            endpoints = list(self._buckets)
+        result = {}
+        for endpoint in endpoints:
+            bucket, breaker, stats = self._get(endpoint)
+            result[endpoint] = {
+                **stats,
+                "wait_seconds": round(stats["wait_seconds"], 2),
+                "rate": round(bucket.rate, 3),
+                "max_rate": bucket.max_rate,
+                "circuit": breaker.state,
+                "circuit_opened": breaker.open_count,
+                "circuit_rejected": breaker.rejected,
+                "retry_after": round(breaker.retry_after(), 1),
+            }
+        return result
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter(is_failure: Optional[Callable[[Exception], bool]] = None) -> UpstreamLimiter:
+    """获取进程内共享的限流器，所有客户端共用同一组令牌桶和熔断器"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = UpstreamLimiter(is_failure=is_failure)
+        return _default_limiter
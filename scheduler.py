@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+后台任务调度模块
+单个常驻线程按优先级队列执行周期性任务，每次执行后按带随机抖动的间隔安排下一次，
+任务失败时按指数退避推迟，并记录每个任务的运行状态
+"""
+
+import time
+import heapq
+import random
+import threading
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_JITTER = 0.1  # 间隔的随机抖动比例，避免多个任务同时请求上游
+BACKOFF_BASE = 30  # 第一次失败后的重试间隔（秒）
+BACKOFF_MAX = 30 * 60  # 失败重试的最长间隔（秒）
+
+
+class Job:
+    """一个周期性任务及其运行状态"""
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float, priority: int = 10,
+                 jitter: float = DEFAULT_JITTER):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.priority = priority
+        self.jitter = jitter
+        self.next_run = 0.0
+        self.version = 0  # 重新安排时递增，队列中旧版本的记录直接丢弃
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+
+    def next_delay(self) -> float:
+        """成功时按间隔，失败时按指数退避，再加上随机抖动"""
+        if self.consecutive_failures:
+            delay = min(BACKOFF_BASE * 2 ** (self.consecutive_failures - 1), BACKOFF_MAX)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def status(self) -> Dict:
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "interval": self.interval,
+            "running": self.running,
+            "next_run_in": round(max(0.0, self.next_run - time.time()), 1),
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_run": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_run)) if self.last_run else None,
+            "last_duration": round(self.last_duration, 2) if self.last_duration is not None else None,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    """单线程优先级任务调度器"""
+
+    def __init__(self, name: str = 'scheduler'):
+        self.name = name
+        self._jobs = {}
+        self._queue = []  # (下次运行时间, 优先级, 版本, 任务名)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def add_job(self, name: str, func: Callable[[], Any], interval: float, priority: int = 10,
+                jitter: float = DEFAULT_JITTER, delay: float = 0) -> Job:
+        """
+        添加周期性任务，同名任务已存在时只更新其配置
+
+        参数:
+            name: 任务名称
+            func: 任务函数，抛出异常视为失败，返回值记录在状态中
+            interval: 执行间隔（秒）
+            priority: 优先级，数值越小越先执行
+            jitter: 间隔的随机抖动比例
+            delay: 第一次执行前的等待时间（秒）
+        """
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is not None:
+                job.func = func
+                job.interval = interval
+                job.priority = priority
+                job.jitter = jitter
+                return job
+            job = Job(name, func, interval, priority, jitter)
+            self._jobs[name] = job
+            self._schedule(job, time.time() + delay)
+            return job
+
+    def _schedule(self, job: Job, run_at: float):
+        job.version += 1
+        job.next_run = run_at
+        heapq.heappush(self._queue, (run_at, job.priority, job.version, job.name))
+        self._cond.notify()
+
+    def trigger(self, name: str) -> bool:
+        """让任务尽快执行一次，任务正在执行或不存在时返回False"""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None or job.running:
+                return False
+            if job.next_run > time.time():
+                self._schedule(job, time.time())
+            return True
+
+    def start(self):
+        """启动调度线程，重复调用不会启动多个"""
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+        print("后台调度线程已启动")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _next_job(self) -> Optional[Job]:
+        """等待并取出下一个到期的任务，停止时返回None"""
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                run_at, _, version, name = self._queue[0]
+                job = self._jobs.get(name)
+                if job is None or job.version != version:
+                    heapq.heappop(self._queue)
+                    continue
+                wait = run_at - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+                job.running = True
+                return job
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            start = time.time()
+            try:
+                result = job.func()
+                job.last_result = result if isinstance(result, (int, float, str, bool, type(None))) else str(result)
+                job.last_error = None
+                job.consecutive_failures = 0
+            except Exception as e:
+                print(f"后台任务 {job.name} 失败: {e}")
+                traceback.print_exc()
+                job.last_error = str(e)
+                job.failures += 1
+                job.consecutive_failures += 1
+            finally:
+                job.runs += 1
+                job.last_run = start
+                job.last_duration = time.time() - start
+                with self._cond:
+                    job.running = False
+                    self._schedule(job, time.time() + job.next_delay())
+
+    def status(self) -> List[Dict]:
+        """所有任务的状态，按下次运行时间排序"""
+        with self._cond:
+            jobs = sorted(self._jobs.values(), key=lambda job: job.next_run)
+            return [job.status() for job in jobs]
@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+小红书请求签名模块
+提供可替换的签名后端：
+    playwright: 常驻的无头浏览器，兼容性最好，内存占用大
+    js: 内嵌JS引擎直接执行签名脚本，不需要浏览器
+    local: 本地替身签名，只用于离线开发和测试，服务端不会接受
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import base64
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from rate_limit import backoff_delay
+
+# 签名配置
+SIGN_HOME_URL = "https://www.xiaohongshu.com"  # 用于加载签名脚本的页面
+SIGN_RETRIES = 5  # 单次签名的最大重试次数
+SIGN_TIMEOUT = 60  # 等待签名结果的超时时间（秒）
+SIGN_MAX_PAGES = 4  # 每个工作线程最多同时保持的a1页面数
+SIGN_WORKERS = 2  # 签名工作线程（浏览器）数量上限
+SIGN_MAX_IN_FLIGHT = 8  # 同时在途的签名请求上限
+SIGN_ACQUIRE_TIMEOUT = 10  # 等待签名名额的超时时间（秒）
+HEALTH_CHECK_INTERVAL = 60  # 空闲时健康检查的间隔（秒）
+SIGN_BACKEND = 'auto'  # 默认签名后端: auto / playwright / js / local
+SIGN_SCRIPT_FILE = 'sign.js'  # js后端加载的签名脚本，需定义 window._webmsxyw
+SIGN_CACHE_TTL = 60  # 签名缓存有效期（秒），需小于服务端允许的 x-t 时间偏差
+SIGN_CACHE_SIZE = 256  # 签名缓存最多保存的条目数
+
+
+class SignStats:
+    """签名耗时统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.relaunches = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float):
+        """记录一次成功签名的耗时"""
+        with self._lock:
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.last_ms = elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_relaunch(self):
+        with self._lock:
+            self.relaunches += 1
+
+    def snapshot(self) -> Dict:
+        """返回统计数据快照"""
+        with self._lock:
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "relaunches": self.relaunches,
+                "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+                "last_ms": round(self.last_ms, 2),
+                "max_ms": round(self.max_ms, 2),
+            }
+
+
+class SignerBusyError(Exception):
+    """签名并发已满且等待超时"""
+
+
+class SignerBackend:
+    """
+    签名后端接口
+
+    子类实现 sign()，返回 {"x-s": ..., "x-t": ...}，并保证可在任意线程调用。
+    """
+
+    name = "base"
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict:
+        """返回签名统计"""
+        return {"backend": self.name}
+
+    def close(self):
+        """释放后端占用的资源"""
+
+
+class _SignJob:
+    """提交给签名线程的任务"""
+
+    def __init__(self, uri, data, a1):
+        self.uri = uri
+        self.data = data
+        self.a1 = a1
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class _SignWorker(threading.Thread):
+    """
+    签名工作线程
+
+    Playwright 的同步对象只能在创建它的线程中使用，因此每个工作线程各自持有一个浏览器，
+    每个 a1 对应一个已加载签名脚本的页面，重复使用。
+    """
+
+    def __init__(self, pool: "PlaywrightSigner", index: int):
+        super().__init__(name=f"xhs-signer-{index}", daemon=True)
+        self.pool = pool
+        self.busy = False
+        self._playwright = None
+        self._browser = None
+        self._pages = {}  # a1 -> (context, page, last_used)
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def run(self):
+        """工作线程主循环"""
+        from playwright.sync_api import sync_playwright
+
+        try:
+            self._playwright = sync_playwright().start()
+        except Exception as e:
+            print(f"启动签名引擎失败: {e}")
+            self.pool._worker_failed(self, e)
+            return
+
+        jobs = self.pool._jobs
+        try:
+            while not self.pool._closed:
+                try:
+                    job = jobs.get(timeout=HEALTH_CHECK_INTERVAL)
+                except queue.Empty:
+                    self._health_check()
+                    continue
+                if job is None:
+                    break
+                if job.cancelled:
+                    continue
+                self.busy = True
+                try:
+                    self._handle(job)
+                finally:
+                    self.busy = False
+        finally:
+            self._shutdown_browser()
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    def _handle(self, job: _SignJob):
+        stats = self.pool.stats
+        start = time.perf_counter()
+        last_error = None
+        for attempt in range(SIGN_RETRIES):
+            try:
+                page = self._get_page(job.a1)
+                encrypt_params = page.evaluate("([url, data]) => window._webmsxyw(url, data)", [job.uri, job.data])
+                job.result = {
+                    "x-s": encrypt_params["X-s"],
+                    "x-t": str(encrypt_params["X-t"])
+                }
+                stats.record((time.perf_counter() - start) * 1000)
+                break
+            except Exception as e:
+                last_error = e
+                print(f"签名失败，重试中: {e}")
+                # 浏览器可能已崩溃或页面失效，丢弃该页面，必要时重启浏览器
+                self._drop_page(job.a1)
+                if not self._browser_alive():
+                    self._relaunch()
+                # 指数退避加随机抖动，最后一次失败后不再等待
+                if attempt < SIGN_RETRIES - 1:
+                    time.sleep(backoff_delay(attempt))
+        else:
+            stats.record_error()
+            job.error = Exception(f"重试多次后签名仍然失败: {last_error}")
+        job.done.set()
+
+    def _browser_alive(self) -> bool:
+        try:
+            return self._browser is not None and self._browser.is_connected()
+        except Exception:
+            return False
+
+    def _launch(self):
+        self._browser = self._playwright.chromium.launch(headless=self.pool.headless)
+        print(f"签名浏览器已启动: {self.name}")
+
+    def _relaunch(self):
+        print(f"签名浏览器不可用，正在重启: {self.name}")
+        self._shutdown_browser()
+        self.pool.stats.record_relaunch()
+
+    def _shutdown_browser(self):
+        for context, _, _ in self._pages.values():
+            try:
+                context.close()
+            except Exception:
+                pass
+        self._pages.clear()
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception:
+                pass
+        self._browser = None
+
+    def _get_page(self, a1: str):
+        """获取 a1 对应的已预热页面，不存在时创建"""
+        entry = self._pages.get(a1)
+        if entry is not None:
+            context, page, _ = entry
+            if not page.is_closed():
+                self._pages[a1] = (context, page, time.time())
+                return page
+            self._drop_page(a1)
+
+        if not self._browser_alive():
+            self._launch()
+
+        # 超过上限时关闭最久未使用的页面
+        while len(self._pages) >= SIGN_MAX_PAGES:
+            oldest = min(self._pages, key=lambda key: self._pages[key][2])
+            self._drop_page(oldest)
+
+        context = self._browser.new_context()
+        page = context.new_page()
+        page.goto(SIGN_HOME_URL)
+        if a1:
+            context.add_cookies([
+                {'name': 'a1', 'value': a1, 'domain': ".xiaohongshu.com", 'path': "/"}
+            ])
+            page.reload()
+            time.sleep(1)
+        self._pages[a1] = (context, page, time.time())
+        return page
+
+    def _drop_page(self, a1: str):
+        entry = self._pages.pop(a1, None)
+        if entry is not None:
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+
+    def _health_check(self):
+        """空闲时检查各页面的签名函数是否可用，失效的页面会被丢弃"""
+        if not self._pages:
+            return
+        if not self._browser_alive():
+            self._relaunch()
+            return
+        for a1 in list(self._pages):
+            _, page, _ = self._pages[a1]
+            try:
+                ok = not page.is_closed() and page.evaluate("typeof window._webmsxyw === 'function'")
+            except Exception:
+                ok = False
+            if not ok:
+                print(f"签名页面健康检查失败，已丢弃: {self.name}")
+                self._drop_page(a1)
+
+
+class PlaywrightSigner(SignerBackend):
+    """
+    常驻浏览器签名引擎
+
+    由最多 workers 个签名线程组成的线程池，共享同一个任务队列，可在任意线程调用。
+    工作线程按需启动：只有在任务排队时才会启动新的浏览器，空闲时不会额外占用内存。
+    同时在途的签名数量受 max_in_flight 限制，超出时调用方最多等待 acquire_timeout 秒。
+    """
+
+    name = "playwright"
+
+    def __init__(
+        self,
+        headless: bool = True,
+        workers: int = SIGN_WORKERS,
+        max_in_flight: int = SIGN_MAX_IN_FLIGHT,
+        acquire_timeout: float = SIGN_ACQUIRE_TIMEOUT,
+        sign_timeout: float = SIGN_TIMEOUT
+    ):
+        self.headless = headless
+        self.workers = max(1, workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.acquire_timeout = acquire_timeout
+        self.sign_timeout = sign_timeout
+        self.stats = SignStats()
+        self._jobs = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._in_flight = 0
+        self._rejected = 0
+        self._workers = []
+        self._worker_ids = itertools.count()
+        self._workers_lock = threading.Lock()
+        self._closed = False
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        """
+        计算签名，可在任意线程调用
+
+        返回:
+            {"x-s": ..., "x-t": ...}
+        """
+        if self._closed:
+            raise RuntimeError("签名引擎已关闭")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._workers_lock:
+                self._rejected += 1
+            raise SignerBusyError(f"签名繁忙，等待{self.acquire_timeout}秒后仍无空闲名额")
+        try:
+            with self._workers_lock:
+                self._in_flight += 1
+            job = _SignJob(uri, data, a1)
+            self._jobs.put(job)
+            self._ensure_workers()
+            if not job.done.wait(self.sign_timeout):
+                job.cancelled = True
+                self.stats.record_error()
+                raise TimeoutError(f"签名超时（{self.sign_timeout}秒）")
+            if job.error is not None:
+                raise job.error
+            return job.result
+        finally:
+            with self._workers_lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def get_stats(self) -> Dict:
+        """返回签名统计"""
+        stats = self.stats.snapshot()
+        stats["backend"] = self.name
+        with self._workers_lock:
+            workers = [worker for worker in self._workers if worker.is_alive()]
+            stats["workers"] = len(workers)
+            stats["max_workers"] = self.workers
+            stats["busy_workers"] = sum(1 for worker in workers if worker.busy)
+            stats["pages"] = sum(worker.page_count for worker in workers)
+            stats["in_flight"] = self._in_flight
+            stats["max_in_flight"] = self.max_in_flight
+            stats["rejected"] = self._rejected
+        stats["queued"] = self._jobs.qsize()
+        return stats
+
+    def close(self):
+        """关闭所有签名线程和浏览器，关闭后不能再签名"""
+        with self._workers_lock:
+            self._closed = True
+            workers = list(self._workers)
+            self._workers = []
+        for _ in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
+        self._fail_pending(RuntimeError("签名引擎已关闭"))
+
+    def _ensure_workers(self):
+        """没有存活的工作线程或任务在排队时，按需启动新的工作线程"""
+        with self._workers_lock:
+            if self._closed:
+                # 与 close() 同时进行时，不再启动新的浏览器
+                self._fail_pending(RuntimeError("签名引擎已关闭"))
+                return
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            idle = sum(1 for worker in self._workers if not worker.busy)
+            if self._workers and (self._jobs.qsize() <= idle or len(self._workers) >= self.workers):
+                return
+            try:
+                import playwright.sync_api  # noqa: F401
+            except ImportError:
+                print("请安装playwright: pip install playwright")
+                print("并安装浏览器: playwright install chromium")
+                self._fail_pending(ImportError("未安装playwright"))
+                raise
+            worker = _SignWorker(self, next(self._worker_ids))
+            self._workers.append(worker)
+            worker.start()
+
+    def _worker_failed(self, worker: _SignWorker, error: Exception):
+        """工作线程启动失败；如果没有其他可用线程，让排队的任务立即失败"""
+        with self._workers_lock:
+            others = [w for w in self._workers if w is not worker and w.is_alive()]
+        if not others:
+            self._fail_pending(error)
+
+    def _fail_pending(self, error: Exception):
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None:
+                job.error = error
+                job.done.set()
+
+
+class JsEngineSigner(SignerBackend):
+    """
+    内嵌JS引擎签名后端
+
+    使用 mini-racer（V8）加载一次签名脚本，之后每次签名只是一次函数调用。
+    签名脚本需要在提供的 window/document 模拟对象上定义 window._webmsxyw(url, data)，
+    并从 document.cookie 中读取 a1。V8 上下文不是线程安全的，签名调用串行执行。
+    """
+
+    name = "js"
+
+    _PRELUDE = """
+        var window = globalThis;
+        var self = globalThis;
+        var document = {cookie: ""};
+        var navigator = {userAgent: "Mozilla/5.0"};
+        var location = {href: "https://www.xiaohongshu.com/"};
+    """
+
+    def __init__(self, script_path: str = SIGN_SCRIPT_FILE):
+        try:
+            from py_mini_racer import MiniRacer
+        except ImportError:
+            print("请安装mini-racer: pip install mini-racer")
+            raise
+        if not os.path.exists(script_path):
+            raise FileNotFoundError(f"签名脚本不存在: {script_path}")
+
+        self.stats = SignStats()
+        self._lock = threading.Lock()
+        self._ctx = MiniRacer()
+        with open(script_path, 'r', encoding='utf-8') as f:
+            self._ctx.eval(self._PRELUDE + f.read())
+        if not self._ctx.eval("typeof window._webmsxyw === 'function'"):
+            raise RuntimeError(f"签名脚本未定义 window._webmsxyw: {script_path}")
+        print(f"JS签名引擎已加载: {script_path}")
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                self._ctx.eval(f"document.cookie = {json.dumps('a1=' + (a1 or ''))};")
+                encrypt_params = self._ctx.call("window._webmsxyw", uri, data)
+        except Exception:
+            self.stats.record_error()
+            raise
+        self.stats.record((time.perf_counter() - start) * 1000)
+        return {
+            "x-s": encrypt_params["X-s"],
+            "x-t": str(encrypt_params["X-t"])
+        }
+
+    def get_stats(self) -> Dict:
+        stats = self.stats.snapshot()
+        stats["backend"] = self.name
+        return stats
+
+
+class LocalSigner(SignerBackend):
+    """
+    本地替身签名后端
+
+    根据请求内容生成格式与真实签名一致的确定性结果，不依赖浏览器和网络。
+    只用于离线开发和测试，服务端不会接受这样的签名。
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.stats = SignStats()
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        start = time.perf_counter()
+        x_t = str(int(time.time() * 1000))
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False, sort_keys=True) if data else ""
+        digest = hashlib.md5(f"{x_t}{uri}{payload}{a1}".encode()).hexdigest()
+        x_s = "XYW_" + base64.b64encode(json.dumps({"signSvn": "local", "payload": digest}).encode()).decode()
+        self.stats.record((time.perf_counter() - start) * 1000)
+        return {"x-s": x_s, "x-t": x_t}
+
+    def get_stats(self) -> Dict:
+        stats = self.stats.snapshot()
+        stats["backend"] = self.name
+        return stats
+
+
+class FallbackSigner(SignerBackend):
+    """主后端签名失败时改用备用后端"""
+
+    name = "fallback"
+
+    def __init__(self, primary: SignerBackend, fallback: SignerBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self._fallbacks = 0
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        try:
+            return self.primary.sign(uri, data, a1=a1, web_session=web_session)
+        except Exception as e:
+            print(f"{self.primary.name}签名失败，改用{self.fallback.name}: {e}")
+            self._fallbacks += 1
+            return self.fallback.sign(uri, data, a1=a1, web_session=web_session)
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": f"{self.primary.name}+{self.fallback.name}",
+            "fallbacks": self._fallbacks,
+            "primary": self.primary.get_stats(),
+            "fallback": self.fallback.get_stats(),
+        }
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+class SignatureCache:
+    """
+    签名结果缓存
+
+    以 (uri, 请求体哈希, a1) 为键的有界LRU缓存，条目在 ttl 秒后过期。
+    GET 请求的查询参数已包含在 uri 中；传入请求体时按键排序后计算哈希。
+    """
+
+    def __init__(self, ttl: float = SIGN_CACHE_TTL, max_size: int = SIGN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (signature, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(uri, data=None, a1="") -> tuple:
+        """生成缓存键"""
+        if data is None:
+            payload_hash = ""
+        else:
+            payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False, sort_keys=True)
+            payload_hash = hashlib.sha256(payload.encode()).hexdigest()
+        return (uri, payload_hash, a1 or "")
+
+    def get(self, key) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[0])
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, signature: Dict):
+        with self._lock:
+            self._entries[key] = (dict(signature), time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+            }
+
+
+class CachingSigner(SignerBackend):
+    """在任意签名后端前加一层签名缓存，重复的只读请求不再重新签名，带请求体的写请求每次都重新签名"""
+
+    def __init__(self, backend: SignerBackend, cache: Optional[SignatureCache] = None):
+        self.backend = backend
+        self.cache = cache or SignatureCache()
+        self.name = backend.name
+
+    def sign(self, uri, data=None, a1="", web_session="") -> Dict:
+        if data is not None:
+            return self.backend.sign(uri, data, a1=a1, web_session=web_session)
+        key = SignatureCache.make_key(uri, data, a1)
+        signature = self.cache.get(key)
+        if signature is not None:
+            return signature
+        signature = self.backend.sign(uri, data, a1=a1, web_session=web_session)
+        self.cache.set(key, signature)
+        return signature
+
+    def get_stats(self) -> Dict:
+        stats = self.backend.get_stats()
+        stats["cache"] = self.cache.get_stats()
+        return stats
+
+    def close(self):
+        self.backend.close()
+
+
+def create_signer(backend: Optional[str] = None) -> SignerBackend:
+    """
+    创建签名后端
+
+    参数:
+        backend: auto / playwright / js / local，为空时使用 SIGN_BACKEND
+            auto 会优先使用JS引擎（需安装 mini-racer 并提供签名脚本），浏览器作为备用
+
+    返回:
+        签名后端实例
+    """
+    backend = backend or SIGN_BACKEND
+    if backend == "playwright":
+        return PlaywrightSigner()
+    if backend == "js":
+        return JsEngineSigner()
+    if backend == "local":
+        return LocalSigner()
+    if backend == "auto":
+        try:
+            return FallbackSigner(JsEngineSigner(), PlaywrightSigner())
+        except Exception as e:
+            print(f"JS签名引擎不可用，使用浏览器签名: {e}")
+            return PlaywrightSigner()
+    raise ValueError(f"未知的签名后端: {backend}")
+
+
+_default_signers = {}
+_default_signer_lock = threading.Lock()
+
+
+def get_default_signer(backend: Optional[str] = None) -> SignerBackend:
+    """获取进程内共享的签名后端，同一种后端只创建一次"""
+    backend = backend or SIGN_BACKEND
+    with _default_signer_lock:
+        if backend not in _default_signers:
+            signer = create_signer(backend)
+            atexit.register(signer.close)
+            _default_signers[backend] = signer
+        return _default_signers[backend]
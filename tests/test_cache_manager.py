@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""缓存管理的测试：并发修改时持久化存储与内存保持一致"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_manager import CacheManager
+from persistent_store import PersistentStore
+
+WAIT_TIMEOUT = 5
+
+
+class BlockingStore(PersistentStore):
+    """写入值为 "first" 的记录时停住，直到测试放行，模拟较慢的磁盘写入"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def set(self, namespace, key, value, *args, **kwargs):
+        if value == "first":
+            self.entered.set()
+            self.release.wait(WAIT_TIMEOUT)
+        super().set(namespace, key, value, *args, **kwargs)
+
+
+class ConcurrentWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = BlockingStore(os.path.join(directory.name, 'cache.db'))
+        self.addCleanup(self.store.close)
+        self.cache = CacheManager(self.store)
+        self.cache.register('notes', ttl=3600, persist=True)
+
+    def start(self, func, *args, **kwargs):
+        thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+        thread.start()
+        self.addCleanup(thread.join, WAIT_TIMEOUT)
+        return thread
+
+    def race_with_slow_set(self, func, *args, **kwargs):
+        """第一个线程写入 "first" 并停在存储写入中，第二个线程随后修改同一个键，再放行第一个线程"""
+        first = self.start(self.cache.set, 'notes', "first", key='k')
+        self.assertTrue(self.store.entered.wait(WAIT_TIMEOUT))
+        second = self.start(func, *args, **kwargs)
+        deadline = time.time() + WAIT_TIMEOUT
+        while self.memory_value('k') == "first" and time.time() < deadline:
+            time.sleep(0.01)
+        self.store.release.set()
+        first.join(WAIT_TIMEOUT)
+        second.join(WAIT_TIMEOUT)
+
+    def stored_value(self, key):
+        row = self.store.get('notes', key)
+        return row[0] if row is not None else None
+
+    def memory_value(self, key):
+        namespace = self.cache._namespace('notes')
+        entry = namespace.entries.get(key)
+        return entry.value if entry is not None else None
+
+    def test_set_set(self):
+        self.race_with_slow_set(self.cache.set, 'notes', "second", key='k')
+        self.assertEqual(self.memory_value('k'), "second")
+        self.assertEqual(self.stored_value('k'), "second")
+
+    def test_set_delete(self):
+        self.race_with_slow_set(self.cache.delete, 'notes', key='k')
+        self.assertIsNone(self.stored_value('k'))
+        self.assertIsNone(self.cache.get_entry('notes', 'k'))
+
+    def test_set_clear(self):
+        self.race_with_slow_set(self.cache.clear, 'notes')
+        self.assertIsNone(self.stored_value('k'))
+        self.assertIsNone(self.cache.get_entry('notes', 'k'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""批量补全xsec_token的测试：笔记列表超过页数上限的账号"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xhs_api
+from signer import LocalSigner
+from xhs_api import XhsSimpleApi, TOKEN_REFRESH_MAX_PAGES
+
+PAGE_COUNT = 8  # 超过 TOKEN_REFRESH_MAX_PAGES 的页数
+PAGE_SIZE = 20
+
+
+class FakeUserPosted:
+    """模拟笔记列表接口，游标为上一页最后一条笔记的ID"""
+
+    def __init__(self):
+        self.note_ids = [f"note{i:03d}" for i in range(PAGE_COUNT * PAGE_SIZE)]
+        self.requests = []
+
+    def get(self, uri, params=None, **kwargs):
+        cursor = params.get("cursor", "")
+        self.requests.append(cursor)
+        start = self.note_ids.index(cursor) + 1 if cursor else 0
+        ids = self.note_ids[start:start + PAGE_SIZE]
+        return {
+            "notes": [{"note_id": note_id, "xsec_token": f"token-{note_id}"} for note_id in ids],
+            "cursor": ids[-1] if ids else "",
+            "has_more": start + PAGE_SIZE < len(self.note_ids),
+        }
+
+
+class RefreshXsecTokensTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        original_output_dir = xhs_api.OUTPUT_DIR
+        xhs_api.OUTPUT_DIR = self.output_dir.name
+        self.addCleanup(setattr, xhs_api, "OUTPUT_DIR", original_output_dir)
+
+        self.api = XhsSimpleApi("a1=test; web_session=test", signer=LocalSigner())
+        self.api.user_id = "user"
+        self.upstream = FakeUserPosted()
+        self.api.client.get = self.upstream.get
+
+    def expire_negative_cache(self, note_id):
+        self.api.xsec_tokens.unavailable[note_id] -= self.api.xsec_tokens.negative_ttl
+
+    def test_page_cap_negative_caches_briefly(self):
+        self.assertIsNone(self.api.resolve_xsec_token("deleted"))
+        self.assertEqual(len(self.upstream.requests), TOKEN_REFRESH_MAX_PAGES)
+
+        # 有效期内再次查找不再翻页
+        self.assertIsNone(self.api.resolve_xsec_token("deleted"))
+        self.assertEqual(len(self.upstream.requests), TOKEN_REFRESH_MAX_PAGES)
+
+        # 比完整翻页后的负缓存先过期
+        marked_at = self.api.xsec_tokens.unavailable["deleted"]
+        self.assertLessEqual(marked_at + self.api.xsec_tokens.negative_ttl,
+                             time.time() + xhs_api.TOKEN_REFRESH_PARTIAL_TTL + 1)
+
+    def test_resumes_from_last_cursor(self):
+        self.assertIsNone(self.api.resolve_xsec_token("deleted"))
+        self.expire_negative_cache("deleted")
+
+        # 过期后从上次停下的位置继续，翻到最后一页
+        self.assertIsNone(self.api.resolve_xsec_token("deleted"))
+        resumed = self.upstream.requests[TOKEN_REFRESH_MAX_PAGES:]
+        self.assertEqual(resumed[0], self.upstream.note_ids[TOKEN_REFRESH_MAX_PAGES * PAGE_SIZE - 1])
+        self.assertEqual(len(resumed), PAGE_COUNT - TOKEN_REFRESH_MAX_PAGES)
+
+        # 翻完整个列表后按完整的有效期记入负缓存
+        self.assertTrue(self.api.xsec_tokens.is_unavailable("deleted"))
+        self.assertEqual(self.api._token_refresh_cursors, {})
+
+    def test_finds_token_after_page_cap(self):
+        last_note = self.upstream.note_ids[-1]
+        self.assertIsNone(self.api.resolve_xsec_token(last_note))
+        self.expire_negative_cache(last_note)
+        self.assertEqual(self.api.resolve_xsec_token(last_note), f"token-{last_note}")
+        self.assertEqual(len(self.upstream.requests), PAGE_COUNT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+缩略图模块
+把原图缩放并转码为指定宽度和格式，用于首页封面和详情页图片，
+缩放在独立的线程池中执行，不占用处理请求的线程；需要安装 Pillow
+"""
+
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+THUMBNAIL_WIDTHS = (150, 300, 600, 1080)  # 允许的宽度，请求的宽度向上取整到其中之一，限制变体数量
+THUMBNAIL_FORMATS = {  # 格式参数 -> (Pillow格式, 内容类型)
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+THUMBNAIL_QUALITY = 80  # 编码质量
+THUMBNAIL_WORKERS = 2  # 缩放线程数
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available() -> bool:
+    """是否安装了 Pillow"""
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def normalize(width: Optional[int], fmt: Optional[str]) -> Optional[Tuple[int, str]]:
+    """
+    规范化请求的宽度和格式
+
+    返回:
+        (宽度, 格式)，没有请求缩略图时返回None
+    """
+    if not width and not fmt:
+        return None
+    fmt = (fmt or 'webp').lower()
+    if fmt not in THUMBNAIL_FORMATS:
+        fmt = 'webp'
+    if not width or width <= 0:
+        width = THUMBNAIL_WIDTHS[-1]
+    width = next((allowed for allowed in THUMBNAIL_WIDTHS if allowed >= width), THUMBNAIL_WIDTHS[-1])
+    return width, fmt
+
+
+def variant_name(width: int, fmt: str) -> str:
+    """缩略图在图片缓存中的变体名称"""
+    return f"w{width}.{fmt}"
+
+
+def make_thumbnail(data: bytes, width: int, fmt: str) -> Tuple[bytes, str]:
+    """
+    缩放并转码图片，只缩小不放大
+
+    返回:
+        (图片数据, 内容类型)
+    """
+    from PIL import Image, ImageOps
+
+    pil_format, content_type = THUMBNAIL_FORMATS[fmt]
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, image.height * width // image.width or 1), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, pil_format, quality=THUMBNAIL_QUALITY)
+    return output.getvalue(), content_type
+
+
+def submit(data: bytes, width: int, fmt: str):
+    """在缩放线程池中执行 make_thumbnail，返回 Future"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+    return _executor.submit(make_thumbnail, data, width, fmt)
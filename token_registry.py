@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+xsec_token 管理模块
+保存从笔记列表、笔记详情和评论接口返回数据中提取的 xsec_token，
+并记录确认拿不到 token 的笔记（负缓存），避免用随机 token 发起注定失败的请求
+"""
+
+import time
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional
+
+NEGATIVE_TTL = 6 * 60 * 60  # 负缓存有效期（秒），过期后允许重新查找
+
+
+class TokenRegistry(MutableMapping):
+    """
+    笔记ID到xsec_token的映射
+
+    可以像字典一样读写笔记的token，底层映射可以是普通字典或 persistent_store.PersistentDict
+    """
+
+    def __init__(self, tokens=None, user_tokens=None, unavailable=None, negative_ttl: float = NEGATIVE_TTL):
+        """
+        参数:
+            tokens: 笔记ID -> xsec_token
+            user_tokens: 用户ID -> 个人主页的xsec_token
+            unavailable: 笔记ID -> 确认拿不到token的时间戳
+            negative_ttl: 负缓存有效期（秒）
+        """
+        self.tokens = tokens if tokens is not None else {}
+        self.user_tokens = user_tokens if user_tokens is not None else {}
+        self.unavailable = unavailable if unavailable is not None else {}
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._stats = {"saved": 0, "hits": 0, "misses": 0, "negative_hits": 0, "marked_unavailable": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def __getitem__(self, note_id):
+        return self.tokens[note_id]
+
+    def __setitem__(self, note_id, xsec_token):
+        self.save(note_id, xsec_token)
+
+    def __delitem__(self, note_id):
+        del self.tokens[note_id]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.tokens)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def lookup(self, note_id: str) -> Optional[str]:
+        """查找笔记的token并计入统计，不存在时返回None"""
+        xsec_token = self.tokens.get(note_id)
+        if xsec_token:
+            self._count("hits")
+        elif self.is_unavailable(note_id):
+            self._count("negative_hits")
+        else:
+            self._count("misses")
+        return xsec_token or None
+
+    def save(self, note_id: str, xsec_token: str) -> bool:
+        """保存笔记的token，返回是否有变化"""
+        if not note_id or not xsec_token:
+            return False
+        self._forget_unavailable(note_id)
+        if self.tokens.get(note_id) == xsec_token:
+            return False
+        self.tokens[note_id] = xsec_token
+        self._count("saved")
+        return True
+
+    def save_user_token(self, user_id: str, xsec_token: str):
+        """保存用户个人主页的token"""
+        if user_id and xsec_token and self.user_tokens.get(user_id) != xsec_token:
+            self.user_tokens[user_id] = xsec_token
+
+    def get_user_token(self, user_id: str) -> Optional[str]:
+        return self.user_tokens.get(user_id) or None
+
+    def harvest_notes(self, notes: Iterable[Dict]) -> int:
+        """从笔记数组（列表接口或详情接口）中提取token，返回新保存的数量"""
+        saved = 0
+        for note in notes:
+            note_id = note.get("note_id") or note.get("id")
+            if note_id and self.save(note_id, note.get("xsec_token", "")):
+                saved += 1
+            user = note.get("user") or {}
+            self.save_user_token(user.get("user_id", ""), user.get("xsec_token", ""))
+        return saved
+
+    def harvest_users(self, users: Iterable[Dict]) -> int:
+        """从用户信息数组（评论作者等）中提取个人主页token"""
+        count = 0
+        for user in users:
+            if user and user.get("xsec_token"):
+                self.save_user_token(user.get("user_id") or user.get("userid", ""), user["xsec_token"])
+                count += 1
+        return count
+
+    def mark_unavailable(self, note_id: str, ttl: Optional[float] = None):
+        """
+        记录该笔记当前拿不到token
+
+        参数:
+            note_id: 笔记ID
+            ttl: 有效期（秒），默认为 negative_ttl；较短的有效期通过提前记录时间实现，存储格式不变
+        """
+        marked_at = time.time()
+        if ttl is not None and ttl < self.negative_ttl:
+            marked_at -= self.negative_ttl - ttl
+        self.unavailable[note_id] = marked_at
+        self._count("marked_unavailable")
+
+    def is_unavailable(self, note_id: str) -> bool:
+        """笔记是否在负缓存中，过期的记录会被删除"""
+        marked_at = self.unavailable.get(note_id)
+        if marked_at is None:
+            return False
+        if time.time() - marked_at < self.negative_ttl:
+            return True
+        self._forget_unavailable(note_id)
+        return False
+
+    def _forget_unavailable(self, note_id: str):
+        """从负缓存中删除，多个线程同时删除同一笔记时不会出错"""
+        if note_id not in self.unavailable:
+            return
+        with self._lock:
+            self.unavailable.pop(note_id, None)
+
+    def missing(self, note_ids: Iterable[str]) -> List[str]:
+        """返回既没有token也不在负缓存中的笔记ID"""
+        return [note_id for note_id in note_ids if not self.tokens.get(note_id) and not self.is_unavailable(note_id)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["notes"] = len(self.tokens)
+        stats["users"] = len(self.user_tokens)
+        stats["unavailable"] = len(self.unavailable)
+        return stats
@@ -7,40 +7,215 @@
 """
 
 import os
-import time
 import json
 import random
 import string
+import threading
 import traceback
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple, Any
 
 from xhs import XhsClient
-from xhs.exception import DataFetchError
+from requests import RequestException
+from xhs.exception import DataFetchError, IPBlockError, SignError, NeedVerifyError
+from xhs.help import sign as creator_sign
+
+import http_session
+from rate_limit import get_default_limiter
+from signer import SignerBackend, CachingSigner, get_default_signer
+from token_registry import TokenRegistry
 
 # 配置信息
 CONFIG_FILE = 'config.json'  # 配置文件路径，用于获取Cookie
 OUTPUT_DIR = 'notes_output'  # 输出目录
+COMMENT_API_HOST = 'https://edith.xiaohongshu.com'  # 评论接口地址
+TOKEN_REFRESH_MAX_PAGES = 5  # 批量补全xsec_token时最多翻阅的笔记列表页数
+TOKEN_REFRESH_PARTIAL_TTL = 30 * 60  # 达到页数上限仍没有找到的笔记的负缓存有效期（秒），过期后从上次停下的位置继续翻页
+COMMENT_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
 
 def generate_xsec_token(length=64):
     """生成随机xsec_token（备用方法）"""
     characters = string.ascii_letters + string.digits
     return ''.join(random.choice(characters) for _ in range(length))
 
+def extract_user_notes_page(result) -> Optional[Dict]:
+    """
+    从笔记列表接口的返回值中取出一页数据，结构不符合预期时返回None
+    
+    返回:
+        {"notes": 笔记数组, "cursor": 下一页游标, "has_more": 是否还有更多}
+    """
+    if isinstance(result, dict):
+        page = None
+        # 如果直接返回了notes数组
+        if "notes" in result:
+            page = result
+        # 如果返回了success字段
+        elif result.get("success") is True and isinstance(result.get("data"), dict) and "notes" in result["data"]:
+            page = result["data"]
+        if page is not None:
+            return {
+                "notes": page.get("notes", []),
+                "cursor": page.get("cursor", ""),
+                "has_more": bool(page.get("has_more", False))
+            }
+    return None
+
+def extract_user_notes(result) -> Optional[List[Dict]]:
+    """从笔记列表接口的返回值中取出笔记数组，结构不符合预期时返回None"""
+    page = extract_user_notes_page(result)
+    return page["notes"] if page is not None else None
+
+def format_comment(comment: Dict) -> Dict:
+    """格式化评论接口返回的单条评论"""
+    user_info = comment.get("user_info", {})
+    return {
+        "comment_id": comment.get("id", ""),
+        "content": comment.get("content", ""),
+        "user_id": user_info.get("user_id", ""),
+        "nickname": user_info.get("nickname", ""),
+        "avatar": user_info.get("image", ""),
+        "likes": int(comment.get("like_count", 0) or 0),
+        "time": comment.get("create_time", ""),
+        "sub_comments": int(comment.get("sub_comment_count", 0) or 0),
+        "reply_to": comment.get("target_comment", {}).get("user_info", {}).get("nickname", "")
+    }
+
+def format_followers(followers_data: Dict) -> List[Dict]:
+    """从关注通知中提取关注者数据"""
+    followers = []
+    for follower in followers_data.get("message_list", []):
+        if follower.get("type") == "follow/you":
+            user_info = follower.get("user", {})
+            followers.append({
+                "user_id": user_info.get("userid", ""),
+                "nickname": user_info.get("nickname", ""),
+                "avatar": user_info.get("images", ""),
+                "desc": "",  # 返回数据中没有描述字段
+                "gender": 0,  # 返回数据中没有性别字段
+                "follow_status": 1 if user_info.get("fstatus") == "fans" else (2 if user_info.get("fstatus") == "both" else 0),
+                "followed_time": datetime.fromtimestamp(follower.get("time", 0)).strftime("%Y-%m-%d %H:%M:%S") if follower.get("time") else ""
+            })
+    return followers
+
+def build_feed_request(note_id: str, xsec_token: str) -> Dict:
+    """构建笔记详情接口的请求体"""
+    return {
+        "source_note_id": note_id,
+        "image_formats": ["jpg", "webp", "avif"],
+        "extra": {"need_body_topic": "1"},
+        "xsec_source": "pc_search",
+        "xsec_token": xsec_token
+    }
+
+def build_user_posted_params(user_id: str, cursor: str, count: int, xsec_token: str) -> Dict:
+    """构建笔记列表接口的查询参数"""
+    return {
+        "num": count, 
+        "cursor": cursor, 
+        "user_id": user_id, 
+        "image_scenes": "FD_WM_WEBP",
+        "xsec_source": "pc_profile",
+        "xsec_token": xsec_token
+    }
+
+def endpoint_for(uri: str, is_creator: bool = False) -> str:
+    """请求路径对应的限流类别"""
+    if is_creator:
+        return 'creator'
+    if '/user_posted' in uri:
+        return 'notes'
+    if '/feed' in uri:
+        return 'feed'
+    if '/comment/' in uri:
+        return 'comments'
+    if '/you/connections' in uri:
+        return 'followers'
+    return 'default'
+
+def is_upstream_rejection(error: Exception) -> bool:
+    """
+    异常是否表示上游在拒绝请求（计入降速和熔断）
+    
+    笔记不存在、token失效等业务错误不算，只有被封IP、验证码、签名错误、网络错误和429/5xx才算
+    """
+    if isinstance(error, (IPBlockError, NeedVerifyError, SignError)):
+        return True
+    if isinstance(error, DataFetchError):
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+        return status is not None and (status == 429 or status >= 500)
+    return isinstance(error, RequestException)
+
+class RateLimitedXhsClient(XhsClient):
+    """
+    所有请求先经过限流器的 XhsClient，熔断期间直接失败，不再签名和请求上游
+
+    XhsClient 把签名写入共享 session 的请求头后再发送请求，多个线程同时请求时会带上其他请求的签名；
+    这里改为把签名作为单次请求的请求头传入，可以安全地并发调用
+    """
+
+    def __init__(self, *args, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or get_default_limiter(is_upstream_rejection)
+
+    def _sign_headers(self, uri: str, data=None, is_creator: bool = False) -> Dict:
+        """计算签名请求头，与 XhsClient._pre_headers 相同，但不写入 session"""
+        if is_creator:
+            signs = creator_sign(uri, data, a1=self.cookie_dict.get("a1"))
+            return {"x-s": signs["x-s"], "x-t": signs["x-t"], "x-s-common": signs["x-s-common"]}
+        return self.external_sign(
+            uri,
+            data,
+            a1=self.cookie_dict.get("a1"),
+            web_session=self.cookie_dict.get("web_session", "")
+        )
+
+    def _signed_request(self, method: str, uri: str, sign_data=None, is_creator: bool = False, **kwargs):
+        with self.limiter.guard(endpoint_for(uri, is_creator)):
+            headers = {**self._sign_headers(uri, sign_data, is_creator), **kwargs.pop("headers", {})}
+            host = self._creator_host if is_creator else self._host
+            return self.request(method=method, url=f"{host}{uri}", headers=headers, **kwargs)
+
+    def get(self, uri: str, params=None, is_creator: bool = False, **kwargs):
+        final_uri = uri
+        if isinstance(params, dict):
+            # 与 XhsClient 保持一致：签名基于未编码的查询字符串
+            final_uri = f"{uri}?" f"{'&'.join([f'{k}={v}' for k, v in params.items()])}"
+        return self._signed_request("GET", final_uri, is_creator=is_creator, **kwargs)
+
+    def post(self, uri: str, data: dict, is_creator: bool = False, **kwargs):
+        json_str = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        return self._signed_request("POST", uri, data, is_creator=is_creator, data=json_str.encode(), **kwargs)
+
 class XhsSimpleApi:
     """小红书简易API封装类"""
 
-    def __init__(self, cookie: str):
+    def __init__(self, cookie: str, signer=None, xsec_tokens=None):
         """
         初始化API客户端
         
         参数:
             cookie: 小红书的Cookie
+            signer: 签名后端实例或名称（auto / playwright / js / local），默认使用进程内共享的签名后端
+            xsec_tokens: 可选，TokenRegistry 或保存xsec_token的字典，传入持久化字典时重启后仍可使用
         """
         self.cookie = cookie
-        self.client = XhsClient(cookie=cookie, sign=self._sign)
+        backend = signer if isinstance(signer, SignerBackend) else get_default_signer(signer)
+        self.signer = CachingSigner(backend)
+        self.client = RateLimitedXhsClient(cookie=cookie, sign=self._sign)
+        self.limiter = self.client.limiter
+        # 使用共享配置的长连接池
+        http_session.mount(self.client.session)
         # 存储已获取的xsec_token
-        self.xsec_tokens = {}
+        self.xsec_tokens = xsec_tokens if isinstance(xsec_tokens, TokenRegistry) else TokenRegistry(xsec_tokens)
+        self._token_refresh_lock = threading.Lock()
+        # 用户ID -> 批量补全上次达到页数上限时停下的游标
+        self._token_refresh_cursors = {}
+        # 当前登录用户的ID，首次需要时获取
+        self.user_id = None
+        # 获取用户笔记列表时使用的备用xsec_token，按用户固定，保证相同请求的签名可以复用
+        self.profile_xsec_tokens = {}
         
         # 确保输出目录存在
         if not os.path.exists(OUTPUT_DIR):
@@ -50,42 +225,111 @@ class XhsSimpleApi:
     def _sign(self, uri, data=None, a1="", web_session=""):
         """
         签名函数，用于小红书API请求的签名
-        这里使用一个简单的实现，实际使用时可能需要更复杂的签名逻辑
+        由可替换的签名后端完成，见 signer.py
+        相同的请求在短时间内复用签名结果
         """
-        try:
-            from playwright.sync_api import sync_playwright
+        return self.signer.sign(uri, data, a1=a1, web_session=web_session)
+    
+    def get_sign_stats(self) -> Dict:
+        """获取签名耗时统计"""
+        return self.signer.get_stats()
+    
+    def save_xsec_token(self, note_id: str, xsec_token: str):
+        """保存笔记的xsec_token"""
+        if self.xsec_tokens.save(note_id, xsec_token):
+            print(f"已保存笔记 {note_id} 的xsec_token: {xsec_token[:10]}...")
+    
+    def save_note_tokens(self, notes: List[Dict]):
+        """保存笔记列表中每条笔记（及作者）的xsec_token"""
+        saved = self.xsec_tokens.harvest_notes(notes)
+        if saved:
+            print(f"已保存{saved}条笔记的xsec_token")
+    
+    def get_self_user_id(self) -> str:
+        """获取当前登录用户的ID"""
+        if not self.user_id:
+            try:
+                self.user_id = self.client.get_self_info2().get("user_id", "")
+            except Exception as e:
+                print(f"获取当前用户ID失败: {e}")
+        return self.user_id or ""
+    
+    def refresh_xsec_tokens(self, note_ids: List[str], max_pages: int = TOKEN_REFRESH_MAX_PAGES) -> int:
+        """
+        通过当前用户的笔记列表批量补全缺失的xsec_token
+        
+        一次翻页可以拿到多条笔记的token，比逐条用随机token试探少很多请求。
+        翻完整个列表后仍找不到的笔记记入负缓存，在有效期内不再查找；
+        达到页数上限时记住停下的游标，剩下的笔记以较短的有效期记入负缓存，过期后从该游标继续翻页
+        
+        参数:
+            note_ids: 需要token的笔记ID
+            max_pages: 最多翻阅的页数
+            
+        返回:
+            补全的token数量
+        """
+        missing = set(self.xsec_tokens.missing(note_ids))
+        if not missing:
+            return 0
+        
+        # 同一时刻只进行一次批量补全，等待的调用方直接使用其结果
+        with self._token_refresh_lock:
+            missing = set(self.xsec_tokens.missing(missing))
+            if not missing:
+                return 0
+            user_id = self.get_self_user_id()
+            if not user_id:
+                return 0
             
-            for _ in range(5):
-                try:
-                    with sync_playwright() as playwright:
-                        chromium = playwright.chromium
-                        browser = chromium.launch(headless=True)
-                        browser_context = browser.new_context()
-                        
-                        context_page = browser_context.new_page()
-                        context_page.goto("https://www.xiaohongshu.com")
-                        
-                        if a1:
-                            browser_context.add_cookies([
-                                {'name': 'a1', 'value': a1, 'domain': ".xiaohongshu.com", 'path': "/"}
-                            ])
-                            context_page.reload()
-                            time.sleep(1)
-                        
-                        encrypt_params = context_page.evaluate("([url, data]) => window._webmsxyw(url, data)", [uri, data])
-                        return {
-                            "x-s": encrypt_params["X-s"],
-                            "x-t": str(encrypt_params["X-t"])
-                        }
-                except Exception as e:
-                    print(f"签名失败，重试中: {e}")
-                    time.sleep(1)
+            wanted = len(missing)
+            cursor = self._token_refresh_cursors.pop(user_id, "")
+            print(f"通过笔记列表补全xsec_token: {wanted}条" + (f"，从游标 {cursor} 继续" if cursor else ""))
+            reached_end = False
+            for page in self.iter_user_note_pages(user_id, cursor=cursor, max_pages=max_pages):
+                if page.get("error"):
+                    # 请求失败时不能确定token是否存在，不记入负缓存，下次从第一页重新开始
+                    return wanted - len(self.xsec_tokens.missing(missing))
+                missing = set(self.xsec_tokens.missing(missing))
+                reached_end = not page["has_more"] or not page["notes"] or page["cursor"] == cursor
+                cursor = page["cursor"]
+                if not missing:
+                    break
+            if not missing:
+                return wanted
             
-            raise Exception("重试多次后签名仍然失败")
-        except ImportError:
-            print("请安装playwright: pip install playwright")
-            print("并安装浏览器: playwright install chromium")
-            raise
+            if reached_end:
+                # 游标之前的页在上一次补全时已经翻过，其中的token都已保存
+                ttl = None
+                for note_id in missing:
+                    print(f"笔记 {note_id} 不在当前用户的笔记列表中，暂不请求其详情")
+            else:
+                # 列表还没有翻完，剩下的笔记可能在后面的页中，下次从这里继续
+                self._token_refresh_cursors[user_id] = cursor
+                ttl = TOKEN_REFRESH_PARTIAL_TTL
+                print(f"翻阅{max_pages}页后仍有{len(missing)}条笔记没有找到token，{ttl // 60}分钟后继续查找")
+            for note_id in missing:
+                self.xsec_tokens.mark_unavailable(note_id, ttl)
+            return wanted - len(missing)
+    
+    def resolve_xsec_token(self, note_id: str, xsec_token: Optional[str] = None) -> Optional[str]:
+        """
+        优先使用传入的xsec_token，其次使用已存储的，再通过笔记列表批量补全
+        
+        返回:
+            xsec_token，确认拿不到时返回None
+        """
+        if xsec_token:
+            return xsec_token
+        
+        xsec_token = self.xsec_tokens.lookup(note_id)
+        if not xsec_token and not self.xsec_tokens.is_unavailable(note_id):
+            self.refresh_xsec_tokens([note_id])
+            xsec_token = self.xsec_tokens.lookup(note_id)
+        
+        if xsec_token:
+            print(f"使用已有的xsec_token: {xsec_token[:10]}...")
+        return xsec_token
     
     def publish_image_note(
         self,
@@ -232,63 +476,141 @@ class XhsSimpleApi:
                 "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
     
-    def get_note_comments(self, note_id: str, cursor: str = "", count: int = 20) -> Dict:
+    def _fetch_comment_api(self, uri: str, params: Dict, note_id: str) -> Optional[Dict]:
+        """使用与网页相同的Cookie请求评论接口，返回data字段"""
+        headers = {
+            "Cookie": self.cookie,
+            "User-Agent": COMMENT_USER_AGENT,
+            "Origin": "https://www.xiaohongshu.com",
+            "Referer": f"https://www.xiaohongshu.com/explore/{note_id}"
+        }
+        with self.limiter.guard(endpoint_for(uri)):
+            response = http_session.get(f"{COMMENT_API_HOST}{uri}", params=params, headers=headers)
+            if response.status_code != 200:
+                raise DataFetchError(f"获取评论失败，状态码: {response.status_code}", response=response)
+        return response.json().get("data")
+    
+    def _comment_page(self, comments_data: Optional[Dict], note_id: str, cursor: str) -> Dict:
+        """把评论接口返回的数据整理成统一的分页结构"""
+        if comments_data is None:
+            print(f"获取笔记评论返回None: {note_id}")
+            comments_data = {"cursor": cursor}
+        # 保存评论作者的个人主页token
+        for comment in comments_data.get("comments", []):
+            self.xsec_tokens.harvest_users([comment.get("user_info")])
+            self.xsec_tokens.harvest_users(sub.get("user_info") for sub in comment.get("sub_comments") or [])
+        return {
+            "note_id": note_id,
+            "comments": [format_comment(comment) for comment in comments_data.get("comments", [])],
+            "has_more": bool(comments_data.get("has_more", False)),
+            "cursor": comments_data.get("cursor", ""),
+            "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    def get_note_comments(self, note_id: str, cursor: str = "", count: int = 20, xsec_token: Optional[str] = None) -> Dict:
         """
         获取笔记的评论
         
         参数:
             note_id: 笔记ID
             cursor: 分页游标
-            count: 每页评论数量
+            count: 每页评论数量（接口每页数量固定，保留参数兼容旧调用）
+            xsec_token: 可选，默认使用已存储的xsec_token
             
         返回:
-            评论列表和分页信息
+            评论列表和分页信息，失败时带有error字段
         """
         try:
-            # 获取笔记评论
-            comments_data = self.client.get_note_comments(note_id, cursor, count)
-            
-            # 检查返回值是否为None
-            if comments_data is None:
-                print(f"获取笔记评论返回None: {note_id}")
-                return {
-                    "note_id": note_id,
-                    "comments": [],
-                    "has_more": False,
-                    "cursor": "",
-                    "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            
-            # 提取评论数据
-            comments = []
-            for comment in comments_data.get("comments", []):
-                comments.append({
-                    "comment_id": comment.get("id", ""),
-                    "content": comment.get("content", ""),
-                    "user_id": comment.get("user_id", ""),
-                    "nickname": comment.get("nickname", ""),
-                    "avatar": comment.get("avatar", ""),
-                    "likes": comment.get("likes", 0),
-                    "time": comment.get("time", ""),
-                    "sub_comments": comment.get("sub_comment_count", 0)
-                })
+            params = {
+                "note_id": note_id,
+                "cursor": cursor,
+                "top_comment_id": "",
+                "image_formats": "jpg,webp,avif"
+            }
+            xsec_token = xsec_token or self.xsec_tokens.get(note_id)
+            if xsec_token:
+                params["xsec_token"] = xsec_token
             
+            comments_data = self._fetch_comment_api('/api/sns/web/v2/comment/page', params, note_id)
+            return self._comment_page(comments_data, note_id, cursor)
+        except Exception as e:
+            print(f"获取笔记评论失败: {e}")
             return {
                 "note_id": note_id,
-                "comments": comments,
-                "has_more": comments_data.get("has_more", False),
-                "cursor": comments_data.get("cursor", ""),
+                "comments": [],
+                "has_more": False,
+                "cursor": cursor,
+                "error": str(e),
                 "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-        except DataFetchError as e:
-            print(f"获取笔记评论失败: {e}")
+    
+    def get_note_sub_comments(self, note_id: str, root_comment_id: str, cursor: str = "", count: int = 10,
+                              xsec_token: Optional[str] = None) -> Dict:
+        """
+        获取评论的回复（子评论）
+        
+        参数:
+            note_id: 笔记ID
+            root_comment_id: 一级评论ID
+            cursor: 分页游标
+            count: 每页数量
+            xsec_token: 可选，默认使用已存储的xsec_token
+            
+        返回:
+            回复列表和分页信息，失败时带有error字段
+        """
+        try:
+            params = {
+                "note_id": note_id,
+                "root_comment_id": root_comment_id,
+                "num": count,
+                "cursor": cursor,
+                "image_formats": "jpg,webp,avif",
+                "top_comment_id": ""
+            }
+            xsec_token = xsec_token or self.xsec_tokens.get(note_id)
+            if xsec_token:
+                params["xsec_token"] = xsec_token
+            
+            comments_data = self._fetch_comment_api('/api/sns/web/v2/comment/sub/page', params, note_id)
+            page = self._comment_page(comments_data, note_id, cursor)
+            page["root_comment_id"] = root_comment_id
+            return page
+        except Exception as e:
+            print(f"获取评论回复失败: {e}")
             return {
                 "note_id": note_id,
+                "root_comment_id": root_comment_id,
                 "comments": [],
+                "has_more": False,
+                "cursor": cursor,
                 "error": str(e),
                 "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
     
+    def iter_note_comments(self, note_id: str, cursor: str = "", xsec_token: Optional[str] = None, max_pages=None):
+        """
+        逐页获取笔记评论，按需请求下一页
+        
+        参数:
+            note_id: 笔记ID
+            cursor: 起始游标
+            xsec_token: 可选，默认使用已存储的xsec_token
+            max_pages: 最多获取的页数，为None时获取到最后一页
+            
+        返回:
+            生成器，每次产生一页评论，结构同 get_note_comments
+        """
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            page = self.get_note_comments(note_id, cursor, xsec_token=xsec_token)
+            pages += 1
+            yield page
+            # 出错、没有更多或游标不再前进时停止
+            if page.get("error") or not page["has_more"] or page["cursor"] == cursor:
+                return
+            cursor = page["cursor"]
+    
     def get_followers(self, cursor: str = "", count: int = 20) -> Dict:
         """
         获取关注者列表
@@ -315,19 +637,8 @@ class XhsSimpleApi:
                 }
             
             # 提取关注者数据
-            followers = []
-            for follower in followers_data.get("message_list", []):
-                if follower.get("type") == "follow/you":
-                    user_info = follower.get("user", {})
-                    followers.append({
-                        "user_id": user_info.get("userid", ""),
-                        "nickname": user_info.get("nickname", ""),
-                        "avatar": user_info.get("images", ""),
-                        "desc": "",  # 返回数据中没有描述字段
-                        "gender": 0,  # 返回数据中没有性别字段
-                        "follow_status": 1 if user_info.get("fstatus") == "fans" else (2 if user_info.get("fstatus") == "both" else 0),
-                        "followed_time": datetime.fromtimestamp(follower.get("time", 0)).strftime("%Y-%m-%d %H:%M:%S") if follower.get("time") else ""
-                    })
+            followers = format_followers(followers_data)
+            self.xsec_tokens.harvest_users(message.get("user") for message in followers_data.get("message_list", []))
             
             return {
                 "followers": followers,
@@ -358,23 +669,14 @@ class XhsSimpleApi:
             # 使用正确的API调用方式
             uri = '/api/sns/web/v1/feed'
             
-            # 优先使用传入的xsec_token，其次使用已存储的，最后随机生成
-            if not xsec_token:
-                xsec_token = self.xsec_tokens.get(note_id)
-            
+            # 优先使用传入的xsec_token，其次使用已存储的，再通过笔记列表批量补全
+            xsec_token = self.resolve_xsec_token(note_id, xsec_token)
             if not xsec_token:
-                xsec_token = generate_xsec_token()
-                print(f"未找到笔记 {note_id} 的xsec_token，使用随机生成的token")
-            else:
-                print(f"使用已有的xsec_token: {xsec_token[:10]}...")
+                # 服务端会拒绝没有有效token的请求，不再用随机token试探
+                print(f"未找到笔记 {note_id} 的xsec_token，跳过请求")
+                return None
             
-            data = {
-                "source_note_id": note_id,
-                "image_formats": ["jpg", "webp", "avif"],
-                "extra": {"need_body_topic": "1"},
-                "xsec_source": "pc_search",
-                "xsec_token": xsec_token
-            }
+            data = build_feed_request(note_id, xsec_token)
             
             res = self.client.post(uri, data=data)
             
@@ -382,8 +684,8 @@ class XhsSimpleApi:
                 note_card = res["items"][0]["note_card"]
                 # 保存获取到的xsec_token以备后用
                 if "xsec_token" in note_card:
-                    self.xsec_tokens[note_id] = note_card["xsec_token"]
-                    print(f"已保存笔记 {note_id} 的xsec_token: {note_card['xsec_token'][:10]}...")
+                    self.save_xsec_token(note_id, note_card["xsec_token"])
+                self.xsec_tokens.harvest_users([note_card.get("user")])
                 return note_card
             else:
                 print(f"获取笔记失败，返回数据结构不符合预期: {res}")
@@ -405,48 +707,71 @@ class XhsSimpleApi:
         返回:
             笔记列表
         """
+        return self.get_user_notes_page(user_id, cursor, count)["notes"]
+    
+    def get_user_notes_page(self, user_id, cursor="", count=20) -> Dict:
+        """
+        获取一页用户笔记
+        
+        参数:
+            user_id: 用户ID
+            cursor: 分页游标
+            count: 每页数量
+            
+        返回:
+            {"notes": 笔记列表, "cursor": 下一页游标, "has_more": 是否还有更多}，失败时带有error字段
+        """
         try:
             uri = '/api/sns/web/v1/user_posted'
-            xsec_token = generate_xsec_token()
+            # 优先使用从其他接口返回数据中保存的主页token，没有时使用按用户固定的备用token
+            xsec_token = (self.xsec_tokens.get_user_token(user_id)
+                          or self.profile_xsec_tokens.setdefault(user_id, generate_xsec_token()))
             
-            params = {
-                "num": count, 
-                "cursor": cursor, 
-                "user_id": user_id, 
-                "image_scenes": "FD_WM_WEBP",
-                "xsec_source": "pc_profile",
-                "xsec_token": xsec_token
-            }
+            params = build_user_posted_params(user_id, cursor, count, xsec_token)
             
             result = self.client.get(uri, params)
-
             
-            # 检查返回结果的结构
-            if isinstance(result, dict):
-                # 如果直接返回了notes数组
-                if "notes" in result:
-                    notes = result.get("notes", [])
-                    # 保存笔记的xsec_token
-                    for note in notes:
-                        if "note_id" in note and "xsec_token" in note:
-                            self.xsec_tokens[note["note_id"]] = note["xsec_token"]
-                            print(f"已保存笔记 {note['note_id']} 的xsec_token: {note['xsec_token'][:10]}...")
-                    return notes
-                # 如果返回了success字段
-                elif result.get("success") is True and result.get("data") is not None:
-                    data = result.get("data")
-                    if "notes" in data:
-                        notes = data.get("notes", [])
-                        # 保存笔记的xsec_token
-                        for note in notes:
-                            if "note_id" in note and "xsec_token" in note:
-                                self.xsec_tokens[note["note_id"]] = note["xsec_token"]
-                                print(f"已保存笔记 {note['note_id']} 的xsec_token: {note['xsec_token'][:10]}...")
-                        return notes
+            page = extract_user_notes_page(result)
+            if page is not None:
+                # 保存笔记的xsec_token
+                self.save_note_tokens(page["notes"])
+                return page
             
             print(f"获取用户笔记失败，API返回: {result}")
-            return []
+            return {"notes": [], "cursor": cursor, "has_more": False, "error": "返回数据结构不符合预期"}
         except Exception as e:
             print(f"获取用户笔记失败: {e}")
             traceback.print_exc()
-            return []
+            return {"notes": [], "cursor": cursor, "has_more": False, "error": str(e)}
+    
+    def iter_user_note_pages(self, user_id, cursor="", count=20, max_pages=None):
+        """
+        逐页获取用户笔记，按需请求下一页
+        
+        参数:
+            user_id: 用户ID
+            cursor: 起始游标，传入之前保存的游标可以从中断处继续
+            count: 每页数量
+            max_pages: 最多获取的页数，为None时获取到最后一页
+            
+        返回:
+            生成器，每次产生一页 {"notes", "cursor", "has_more"}，其中cursor可用于恢复迭代
+        """
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            page = self.get_user_notes_page(user_id, cursor, count)
+            pages += 1
+            yield page
+            # 出错、没有更多或游标不再前进时停止
+            if page.get("error") or not page["has_more"] or not page["notes"] or page["cursor"] == cursor:
+                return
+            cursor = page["cursor"]
+    
+    def iter_user_notes(self, user_id, cursor="", count=20, max_pages=None):
+        """
+        逐条产生用户的全部笔记，按需翻页，内存占用只与每页大小有关
+        
+        参数同 iter_user_note_pages
+        """
+        for page in self.iter_user_note_pages(user_id, cursor, count, max_pages):
+            yield from page["notes"]
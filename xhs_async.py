@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+小红书异步API模块
+基于 asyncio + httpx，接口与 XhsSimpleApi 保持一致，所有请求共享同一个连接池，
+适合在单个事件循环中并发发起大量请求
+"""
+
+import json
+import asyncio
+import traceback
+from datetime import datetime
+from typing import List, Dict, Optional
+
+import httpx
+from requests import RequestException
+from xhs.exception import DataFetchError, IPBlockError, SignError, NeedVerifyError, ErrorEnum
+
+from rate_limit import get_default_limiter
+from signer import SignerBackend, CachingSigner, get_default_signer
+from token_registry import TokenRegistry
+from xhs_api import (
+    XhsSimpleApi, generate_xsec_token, extract_user_notes, format_comment, format_followers,
+    build_feed_request, build_user_posted_params, endpoint_for, is_upstream_rejection
+)
+
+API_HOST = "https://edith.xiaohongshu.com"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
+MAX_CONNECTIONS = 20  # 连接池最大连接数
+MAX_KEEPALIVE_CONNECTIONS = 10  # 保持空闲的长连接数
+REQUEST_TIMEOUT = 10  # 请求超时时间（秒）
+DEFAULT_CONCURRENCY = 8  # 批量请求的默认并发数
+
+
+def _http2_available() -> bool:
+    """安装了 h2 时启用 HTTP/2"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class AsyncXhsSimpleApi:
+    """小红书简易API的异步版本"""
+
+    def __init__(self, cookie: str, signer=None, xsec_tokens: Optional[Dict] = None):
+        """
+        初始化异步API客户端
+
+        参数:
+            cookie: 小红书的Cookie
+            signer: 签名后端实例或名称，与 XhsSimpleApi 相同
+            xsec_tokens: 可选，与同步客户端共享的 TokenRegistry 或xsec_token字典
+        """
+        self.cookie = cookie
+        backend = signer if isinstance(signer, SignerBackend) else get_default_signer(signer)
+        self.signer = backend if isinstance(backend, CachingSigner) else CachingSigner(backend)
+        self.xsec_tokens = xsec_tokens if isinstance(xsec_tokens, TokenRegistry) else TokenRegistry(xsec_tokens)
+        self.profile_xsec_tokens = {}
+        self.cookie_dict = self._parse_cookie(cookie)
+        # 与同步客户端共用进程内的限流器和熔断器
+        self.limiter = get_default_limiter(is_upstream_rejection)
+        self._sync_api = None
+        self.http = httpx.AsyncClient(
+            base_url=API_HOST,
+            headers={
+                "user-agent": USER_AGENT,
+                "Content-Type": "application/json",
+                "Cookie": cookie,
+            },
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            ),
+            timeout=REQUEST_TIMEOUT,
+            http2=_http2_available()
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.http.aclose()
+
+    @staticmethod
+    def _parse_cookie(cookie: str) -> Dict:
+        result = {}
+        for item in cookie.split(';'):
+            if '=' in item:
+                key, value = item.strip().split('=', 1)
+                result[key] = value
+        return result
+
+    async def _sign_headers(self, uri: str, data=None) -> Dict:
+        # 签名后端是同步的，放到线程池中执行，命中签名缓存时直接返回
+        return await asyncio.to_thread(
+            self.signer.sign,
+            uri,
+            data,
+            a1=self.cookie_dict.get("a1", ""),
+            web_session=self.cookie_dict.get("web_session", "")
+        )
+
+    def _parse_response(self, response: httpx.Response):
+        """与 XhsClient.request 相同的返回值处理"""
+        if not response.text:
+            return response
+        try:
+            data = response.json()
+        except json.JSONDecodeError:
+            return response
+        if response.status_code in (461, 471):
+            verify_type = response.headers.get('Verifytype')
+            verify_uuid = response.headers.get('Verifyuuid')
+            raise NeedVerifyError(
+                f"出现验证码，请求失败，Verifytype: {verify_type}，Verifyuuid: {verify_uuid}",
+                response=response, verify_type=verify_type, verify_uuid=verify_uuid)
+        elif data.get("success"):
+            return data.get("data", data.get("success"))
+        elif data.get("code") == ErrorEnum.IP_BLOCK.value.code:
+            raise IPBlockError(ErrorEnum.IP_BLOCK.value.msg, response=response)
+        elif data.get("code") == ErrorEnum.SIGN_FAULT.value.code:
+            raise SignError(ErrorEnum.SIGN_FAULT.value.msg, response=response)
+        else:
+            raise DataFetchError(data, response=response)
+
+    async def get(self, uri: str, params: Optional[Dict] = None):
+        """发送签名的GET请求"""
+        final_uri = uri
+        if isinstance(params, dict):
+            # 与 XhsClient 保持一致：签名基于未编码的查询字符串
+            final_uri = f"{uri}?" f"{'&'.join([f'{k}={v}' for k, v in params.items()])}"
+        return await self._guarded(endpoint_for(uri), self._get(final_uri))
+
+    async def _get(self, final_uri: str):
+        headers = await self._sign_headers(final_uri)
+        response = await self.http.get(final_uri, headers=headers)
+        return self._parse_response(response)
+
+    async def post(self, uri: str, data: Dict):
+        """发送签名的POST请求"""
+        return await self._guarded(endpoint_for(uri), self._post(uri, data))
+
+    async def _post(self, uri: str, data: Dict):
+        headers = await self._sign_headers(uri, data)
+        body = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+        response = await self.http.post(uri, content=body, headers=headers)
+        return self._parse_response(response)
+
+    async def _guarded(self, endpoint: str, request):
+        """经过限流器执行请求协程，熔断时不再签名和请求上游"""
+        try:
+            # 等待令牌可能会阻塞，放到线程池中执行
+            await asyncio.to_thread(self.limiter.before, endpoint)
+        except Exception:
+            request.close()
+            raise
+        try:
+            result = await request
+        except httpx.TransportError as e:
+            # 网络错误与同步客户端的 requests 异常同等计入熔断
+            self.limiter.after(endpoint, RequestException(str(e)))
+            raise
+        except asyncio.CancelledError:
+            self.limiter.cancel(endpoint)
+            raise
+        except Exception as e:
+            self.limiter.after(endpoint, e)
+            raise
+        self.limiter.after(endpoint)
+        return result
+
+    def _save_xsec_token(self, note_id: str, xsec_token: str):
+        self.xsec_tokens.save(note_id, xsec_token)
+
+    async def refresh_xsec_tokens(self, note_ids: List[str]) -> int:
+        """通过笔记列表批量补全缺失的xsec_token，同 XhsSimpleApi.refresh_xsec_tokens"""
+        if not self.xsec_tokens.missing(note_ids):
+            return 0
+        return await asyncio.to_thread(self._get_sync_api().refresh_xsec_tokens, note_ids)
+
+    async def get_user_notes(self, user_id, cursor="", count=20):
+        """
+        获取用户笔记列表
+
+        参数:
+            user_id: 用户ID
+            cursor: 分页游标
+            count: 每页数量
+
+        返回:
+            笔记列表
+        """
+        try:
+            uri = '/api/sns/web/v1/user_posted'
+            xsec_token = (self.xsec_tokens.get_user_token(user_id)
+                          or self.profile_xsec_tokens.setdefault(user_id, generate_xsec_token()))
+            result = await self.get(uri, build_user_posted_params(user_id, cursor, count, xsec_token))
+
+            notes = extract_user_notes(result)
+            if notes is not None:
+                self.xsec_tokens.harvest_notes(notes)
+                return notes
+
+            print(f"获取用户笔记失败，API返回: {result}")
+            return []
+        except Exception as e:
+            print(f"获取用户笔记失败: {e}")
+            traceback.print_exc()
+            return []
+
+    async def get_note_by_id(self, note_id, xsec_token=None):
+        """
+        获取笔记详情
+
+        参数:
+            note_id: 笔记ID
+            xsec_token: 可选，指定xsec_token
+
+        返回:
+            笔记详情数据
+        """
+        try:
+            uri = '/api/sns/web/v1/feed'
+            if not xsec_token:
+                await self.refresh_xsec_tokens([note_id])
+                xsec_token = self.xsec_tokens.lookup(note_id)
+            if not xsec_token:
+                print(f"未找到笔记 {note_id} 的xsec_token，跳过请求")
+                return None
+            res = await self.post(uri, build_feed_request(note_id, xsec_token))
+
+            if isinstance(res, dict) and "items" in res and len(res["items"]) > 0:
+                note_card = res["items"][0]["note_card"]
+                if "xsec_token" in note_card:
+                    self._save_xsec_token(note_id, note_card["xsec_token"])
+                return note_card
+
+            print(f"获取笔记失败，返回数据结构不符合预期: {res}")
+            return None
+        except Exception as e:
+            print(f"获取笔记失败: {e}")
+            traceback.print_exc()
+            return None
+
+    async def get_notes_by_ids(self, note_ids: List[str], concurrency: int = DEFAULT_CONCURRENCY) -> Dict:
+        """
+        并发获取多条笔记详情
+
+        参数:
+            note_ids: 笔记ID列表
+            concurrency: 最大并发数
+
+        返回:
+            笔记ID到笔记详情的字典，获取失败的为None
+        """
+        # 先用一次列表翻页补全所有缺失的token，避免每条笔记各自补全
+        await self.refresh_xsec_tokens(note_ids)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(note_id):
+            async with semaphore:
+                return note_id, await self.get_note_by_id(note_id)
+
+        results = await asyncio.gather(*(fetch(note_id) for note_id in note_ids))
+        return dict(results)
+
+    async def get_note_comments(self, note_id: str, cursor: str = "", count: int = 20) -> Dict:
+        """
+        获取笔记的评论
+
+        参数:
+            note_id: 笔记ID
+            cursor: 分页游标
+            count: 每页评论数量（接口固定返回一页，保留参数与同步版本一致）
+
+        返回:
+            评论列表和分页信息
+        """
+        try:
+            params = {
+                "note_id": note_id,
+                "cursor": cursor,
+                "top_comment_id": "",
+                "image_formats": "jpg,webp,avif"
+            }
+            if self.xsec_tokens.get(note_id):
+                params["xsec_token"] = self.xsec_tokens[note_id]
+            comments_data = await self.get('/api/sns/web/v2/comment/page', params)
+
+            if not isinstance(comments_data, dict):
+                print(f"获取笔记评论返回None: {note_id}")
+                comments_data = {}
+            self.xsec_tokens.harvest_users(comment.get("user_info") for comment in comments_data.get("comments", []))
+
+            return {
+                "note_id": note_id,
+                "comments": [format_comment(comment) for comment in comments_data.get("comments", [])],
+                "has_more": comments_data.get("has_more", False),
+                "cursor": comments_data.get("cursor", ""),
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        except Exception as e:
+            print(f"获取笔记评论失败: {e}")
+            return {
+                "note_id": note_id,
+                "comments": [],
+                "error": str(e),
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+    async def get_followers(self, cursor: str = "", count: int = 20) -> Dict:
+        """
+        获取关注者列表
+
+        参数:
+            cursor: 分页游标
+            count: 每页数量
+
+        返回:
+            关注者列表和分页信息
+        """
+        try:
+            followers_data = await self.get('/api/sns/web/v1/you/connections', {"num": count, "cursor": cursor})
+
+            if not isinstance(followers_data, dict):
+                print("获取关注者列表返回None")
+                followers_data = {}
+
+            return {
+                "followers": format_followers(followers_data),
+                "has_more": followers_data.get("has_more", False),
+                "cursor": followers_data.get("cursor", ""),
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        except Exception as e:
+            print(f"获取关注者列表失败: {e}")
+            return {
+                "followers": [],
+                "error": str(e),
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+    def _get_sync_api(self) -> XhsSimpleApi:
+        # 发布流程包含多步上传，直接复用同步实现，在线程池中执行
+        if self._sync_api is None:
+            self._sync_api = XhsSimpleApi(self.cookie, signer=self.signer.backend)
+            self._sync_api.xsec_tokens = self.xsec_tokens
+        return self._sync_api
+
+    async def publish_image_note(self, *args, **kwargs) -> Dict:
+        """发布图文笔记，参数同 XhsSimpleApi.publish_image_note"""
+        return await asyncio.to_thread(self._get_sync_api().publish_image_note, *args, **kwargs)
+
+    async def publish_video_note(self, *args, **kwargs) -> Dict:
+        """发布视频笔记，参数同 XhsSimpleApi.publish_video_note"""
+        return await asyncio.to_thread(self._get_sync_api().publish_video_note, *args, **kwargs)